@@ -0,0 +1,78 @@
+"""deduplicate marker sequences
+
+Revision ID: 51def35584ec
+Revises: beb5d129a0fd
+Create Date: 2026-10-19 11:24:53.086127
+
+"""
+import hashlib
+
+from alembic import op
+import sqlalchemy as sa
+
+from fungphy.compression import decode, encode
+
+
+# revision identifiers, used by Alembic.
+revision = '51def35584ec'
+down_revision = 'beb5d129a0fd'
+branch_labels = None
+depends_on = None
+
+BATCH = 5000
+
+
+def upgrade():
+    sequences = op.create_table('marker_sequence',
+    sa.Column('hash', sa.LargeBinary(), nullable=False),
+    sa.Column('sequence', sa.LargeBinary(), nullable=True),
+    sa.PrimaryKeyConstraint('hash', name=op.f('pk_marker_sequence'))
+    )
+
+    with op.batch_alter_table('marker', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('sequence_hash', sa.LargeBinary(), nullable=True))
+        batch_op.create_foreign_key(batch_op.f('fk_marker_sequence_hash_marker_sequence'), 'marker_sequence', ['sequence_hash'], ['hash'])
+
+    # Store each distinct sequence once, and point markers at it by hash
+    connection = op.get_bind()
+    select = sa.text(
+        "SELECT id, sequence FROM marker"
+        " WHERE id > :last AND sequence IS NOT NULL ORDER BY id LIMIT :limit"
+    )
+    update = sa.text("UPDATE marker SET sequence_hash = :hash WHERE id = :id")
+    seen, last = set(), 0
+    while True:
+        rows = connection.execute(select, last=last, limit=BATCH).fetchall()
+        if not rows:
+            break
+        new, hashes = [], []
+        for id, packed in rows:
+            sequence = decode(packed)
+            key = hashlib.blake2b(sequence.encode(), digest_size=16).digest()
+            if key not in seen:
+                seen.add(key)
+                new.append({"hash": key, "sequence": encode(sequence)})
+            hashes.append({"id": id, "hash": key})
+        if new:
+            op.bulk_insert(sequences, new)
+        connection.execute(update, hashes)
+        last = rows[-1][0]
+
+    with op.batch_alter_table('marker', schema=None) as batch_op:
+        batch_op.drop_column('sequence')
+
+
+def downgrade():
+    with op.batch_alter_table('marker', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('sequence', sa.LargeBinary(), nullable=True))
+
+    op.execute(
+        "UPDATE marker SET sequence = ("
+        "SELECT sequence FROM marker_sequence WHERE hash = marker.sequence_hash)"
+    )
+
+    with op.batch_alter_table('marker', schema=None) as batch_op:
+        batch_op.drop_constraint('fk_marker_sequence_hash_marker_sequence', type_='foreignkey')
+        batch_op.drop_column('sequence_hash')
+
+    op.drop_table('marker_sequence')
@@ -0,0 +1,56 @@
+"""pack marker sequences
+
+Revision ID: beb5d129a0fd
+Revises: 8c1d2e7a9b40
+Create Date: 2026-10-19 10:02:17.412936
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from fungphy.compression import decode, encode
+
+
+# revision identifiers, used by Alembic.
+revision = 'beb5d129a0fd'
+down_revision = '8c1d2e7a9b40'
+branch_labels = None
+depends_on = None
+
+BATCH = 5000
+
+
+def convert(function):
+    """Rewrite every marker sequence with function, in batches of rows."""
+    connection = op.get_bind()
+    select = sa.text(
+        "SELECT id, sequence FROM marker"
+        " WHERE id > :last AND sequence IS NOT NULL ORDER BY id LIMIT :limit"
+    )
+    update = sa.text("UPDATE marker SET sequence = :sequence WHERE id = :id")
+    last = 0
+    while True:
+        rows = connection.execute(select, last=last, limit=BATCH).fetchall()
+        if not rows:
+            break
+        connection.execute(
+            update,
+            [{"id": id, "sequence": function(sequence)} for id, sequence in rows],
+        )
+        last = rows[-1][0]
+
+
+def upgrade():
+    # Pack while the column is still text; SQLite keeps the blobs as they are
+    # when the table is copied to change the column type
+    convert(lambda sequence: encode(decode(sequence)))
+
+    with op.batch_alter_table('marker', schema=None) as batch_op:
+        batch_op.alter_column('sequence', existing_type=sa.String(), type_=sa.LargeBinary())
+
+
+def downgrade():
+    convert(decode)
+
+    with op.batch_alter_table('marker', schema=None) as batch_op:
+        batch_op.alter_column('sequence', existing_type=sa.LargeBinary(), type_=sa.String())
@@ -0,0 +1,86 @@
+"""Deterministic synthetic data for benchmarks.
+
+Every generator takes a seed, so the same scale and seed give identical
+inputs on every commit and timings stay comparable.
+"""
+
+import random
+
+import numpy as np
+
+import fungphy.phylogeny as phy
+from fungphy import synthetic
+
+
+BASES = np.frombuffer(b"ACGT", dtype=np.uint8)
+GAP = ord("-")
+
+
+def random_sequences(count, length, seed=0, divergence=0.1):
+    """Generate related sequences as a (count, length) uint8 matrix.
+
+    Each row is a common ancestor with a `divergence` fraction of sites
+    substituted at random.
+    """
+    rng = np.random.default_rng(seed)
+    ancestor = rng.choice(BASES, size=length)
+    matrix = np.tile(ancestor, (count, 1))
+    mutated = rng.random((count, length)) < divergence
+    matrix[mutated] = rng.choice(BASES, size=int(mutated.sum()))
+    return matrix
+
+
+def random_msa(count, length, name="marker", seed=0, ragged=0.05):
+    """Generate an MSA of `count` related sequences.
+
+    Up to `ragged` of the alignment length is gapped at either end of each
+    row, as in alignments of partial sequences, so trimming has work to do.
+    """
+    rng = np.random.default_rng(seed + 1)
+    matrix = random_sequences(count, length, seed=seed)
+    limit = max(int(length * ragged), 1)
+    starts = rng.integers(0, limit, size=count)
+    ends = rng.integers(0, limit, size=count)
+    for row, start, end in zip(matrix, starts, ends):
+        row[:start] = GAP
+        if end:
+            row[-end:] = GAP
+    return phy.MSA(
+        name=name,
+        records=[
+            phy.Sequence(str(i), row.tobytes().decode("ascii"))
+            for i, row in enumerate(matrix, 1)
+        ],
+    )
+
+
+def random_multimsa(count, lengths=(600, 500, 500, 900), seed=0):
+    """Generate a MultiMSA with one partition per entry in lengths."""
+    return phy.MultiMSA(
+        [
+            random_msa(count, length, name=f"marker{i}", seed=seed + i)
+            for i, length in enumerate(lengths)
+        ]
+    )
+
+
+def random_newick(leaves, seed=0, support=True):
+    """Generate a random binary tree in Newick format.
+
+    Leaves are named 1..leaves and the tree is built by joining random pairs
+    of subtrees, giving a mix of balanced and unbalanced clades. Internal
+    nodes get random support values if `support` is True.
+    """
+    rng = random.Random(seed)
+    nodes = [f"{i}:{rng.uniform(0.001, 0.1):.5f}" for i in range(1, leaves + 1)]
+    while len(nodes) > 2:
+        a = nodes.pop(rng.randrange(len(nodes)))
+        b = nodes.pop(rng.randrange(len(nodes)))
+        label = f"{rng.randint(50, 100)}" if support else ""
+        nodes.append(f"({a},{b}){label}:{rng.uniform(0.001, 0.05):.5f}")
+    return f"({','.join(nodes)});"
+
+
+def populate_db(path, strains=1000, seed=0):
+    """Create a SQLite database of synthetic strains; see fungphy.synthetic."""
+    return synthetic.populate(path, strains=strains, seed=seed)
@@ -0,0 +1,349 @@
+"""Run fungphy benchmarks on synthetic data and compare against a baseline.
+
+Usage:
+    python benchmarks/run.py --scale 1000 --output results.json
+    python benchmarks/run.py --scale 1000 --compare results.json
+
+Inputs are generated from a seed at the given scale (number of strains), and
+external programs are replaced by the stubs in benchmarks/stubs, so results
+only depend on the code being benchmarked. Results are JSON; --compare exits
+with status 1 if any benchmark is slower than the baseline by more than
+--threshold.
+"""
+
+import argparse
+import atexit
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from pathlib import Path
+
+
+ROOT = Path(__file__).resolve().parent
+STUBS = ROOT / "stubs"
+BENCHMARKS = {}
+
+# Set up an isolated database, stubbed programs and headless Qt before
+# fungphy creates its engine on import
+_workdir = tempfile.mkdtemp(prefix="fungphy-bench-")
+atexit.register(shutil.rmtree, _workdir, ignore_errors=True)
+os.environ["FUNGPHY_DB"] = str(Path(_workdir) / "fungphy.db")
+os.environ["PATH"] = f"{STUBS}{os.pathsep}{os.environ.get('PATH', '')}"
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+sys.path.insert(0, str(ROOT.parent))
+sys.path.insert(0, str(ROOT))
+
+import generators  # noqa: E402
+import fungphy.phylogeny as phy  # noqa: E402
+from ete3 import Tree  # noqa: E402
+from fungphy import distance, query, writers  # noqa: E402
+from fungphy.compact import CompactTree  # noqa: E402
+from fungphy.compare import TreeSet  # noqa: E402
+from fungphy.database import session  # noqa: E402
+
+
+def benchmark(name, limit=None):
+    """Register a benchmark function, which is given a Data object.
+
+    limit caps the scale used by benchmarks with super-linear cost.
+    """
+
+    def decorator(function):
+        BENCHMARKS[name] = (function, limit)
+        return function
+
+    return decorator
+
+
+class Data:
+    """Lazily generated synthetic inputs at a given scale."""
+
+    def __init__(self, scale, seed, folder):
+        self.scale = scale
+        self.seed = seed
+        self.folder = Path(folder)
+        self._cache = {}
+
+    def get(self, key, factory):
+        if key not in self._cache:
+            self._cache[key] = factory()
+        return self._cache[key]
+
+    def multimsa(self, scale=None):
+        scale = scale or self.scale
+        return self.get(
+            ("multimsa", scale), lambda: generators.random_multimsa(scale, seed=self.seed)
+        )
+
+    def fasta(self):
+        return self.get("fasta", lambda: self.multimsa().fasta())
+
+    def binary(self):
+        def write():
+            path = self.folder / "alignment.fmsa"
+            self.multimsa().save_binary(path)
+            return path
+
+        return self.get("binary", write)
+
+    def newick(self, scale=None, seed=0):
+        scale = scale or self.scale
+        return self.get(
+            ("newick", scale, seed),
+            lambda: generators.random_newick(scale, seed=self.seed + seed),
+        )
+
+    def database(self):
+        def populate():
+            return generators.populate_db(
+                os.environ["FUNGPHY_DB"], self.scale, seed=self.seed
+            )
+
+        return self.get("database", populate)
+
+
+@benchmark("import_cli")
+def bench_import_cli(data):
+    """Import the CLI and web views in a fresh interpreter, without ete3/Qt."""
+    code = (
+        "import sys, fungphy.main, fungphy.views; "
+        "heavy = [m for m in ('ete3', 'PyQt5') if m in sys.modules]; "
+        "sys.exit(f'Imported: {heavy}' if heavy else 0)"
+    )
+    env = dict(os.environ, PYTHONPATH=str(ROOT.parent))
+    process = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, env=env
+    )
+    if process.returncode:
+        raise RuntimeError(process.stderr.strip() or process.stdout.strip())
+
+
+@benchmark("parse_alignment")
+def bench_parse_alignment(data):
+    phy.parse_alignment(io.StringIO(data.fasta()))
+
+
+@benchmark("trim")
+def bench_trim(data):
+    phy.trim(data.multimsa()[0], threshold=0.1)
+
+
+@benchmark("multimsa_fasta")
+def bench_multimsa_fasta(data):
+    data.multimsa().fasta()
+
+
+@benchmark("write_nexus")
+def bench_write_nexus(data):
+    writers.write_alignment(io.StringIO(), data.multimsa(), format="nexus")
+
+
+@benchmark("load_binary")
+def bench_load_binary(data):
+    phy.MultiMSA.from_binary(data.binary())
+
+
+@benchmark("distance_matrix", limit=2000)
+def bench_distance_matrix(data):
+    distance.distance_matrix(data.multimsa(min(data.scale, 2000)), model="k2p")
+
+
+@benchmark("neighbour_joining", limit=2000)
+def bench_neighbour_joining(data):
+    distance.quick_tree(data.multimsa(min(data.scale, 2000)))
+
+
+@benchmark("compact_prune")
+def bench_compact_prune(data):
+    tree = CompactTree.from_newick(data.newick())
+    tree.prune(tree.get_leaf_names()[::2]).write()
+
+
+@benchmark("rf_distance")
+def bench_rf_distance(data):
+    TreeSet([Tree(data.newick()), Tree(data.newick(seed=1))]).rf_matrix()
+
+
+@benchmark("merge_support_values")
+def bench_merge_support_values(data):
+    from fungphy import plot
+
+    plot.merge_support_values([Tree(data.newick()), Tree(data.newick(seed=1))])
+
+
+@benchmark("get_species")
+def bench_get_species(data):
+    genus = data.database()["genera"][0]
+    session.remove()
+    query.get_species(genera=[genus], markers=["ITS", "BenA"])
+
+
+@benchmark("strains_route")
+def bench_strains_route(data):
+    data.database()
+    session.remove()
+    response = client().get("/strains")
+    if response.status_code != 200:
+        raise RuntimeError(f"/strains returned {response.status_code}")
+
+
+@benchmark("align_strains_stub", limit=1000)
+def bench_align_strains(data):
+    data.database()
+    session.remove()
+    strains = query.get_species(strain_ids=list(range(1, min(data.scale, 1000) + 1)))
+    query.align_strains(
+        strains, ["ITS", "BenA", "CaM", "RPB2"], pad_missing=True, trim_msa=True
+    )
+
+
+@benchmark("infer_trees_stub", limit=1000)
+def bench_infer_trees(data):
+    phy.infer_trees(data.multimsa(min(data.scale, 1000)), runner="fasttree", cpus=4)
+
+
+def client():
+    from flask import Flask
+
+    from fungphy.views import view
+
+    app = Flask("fungphy")
+    app.register_blueprint(view)
+    return app.test_client()
+
+
+def time_benchmark(function, data, repeat):
+    function(data)  # Warm up caches and lazily generated inputs
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(data)
+        timings.append(time.perf_counter() - start)
+    return {
+        "min": min(timings),
+        "median": statistics.median(timings),
+        "mean": statistics.mean(timings),
+        "repeat": repeat,
+    }
+
+
+def git_commit():
+    process = subprocess.run(
+        ["git", "rev-parse", "--short", "HEAD"],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+    )
+    return process.stdout.strip() or None
+
+
+def compare(results, baseline, threshold):
+    """Print median time ratios against a baseline; return names of regressions."""
+    regressions = []
+    print(f"\n{'benchmark':<24}{'baseline':>12}{'current':>12}{'ratio':>8}")
+    for name, result in results.items():
+        base = baseline.get(name)
+        if not base or "median" not in base or "median" not in result:
+            continue
+        ratio = result["median"] / base["median"] if base["median"] else float("inf")
+        flag = " !" if ratio > threshold else ""
+        if flag:
+            regressions.append(name)
+        print(
+            f"{name:<24}{base['median']:>12.4f}{result['median']:>12.4f}"
+            f"{ratio:>8.2f}{flag}"
+        )
+    return regressions
+
+
+def get_parser():
+    parser = argparse.ArgumentParser("fungphy-benchmarks")
+    parser.add_argument("-s", "--scale", type=int, default=1000, help="Number of strains/sequences/leaves")
+    parser.add_argument("-r", "--repeat", type=int, default=5, help="Timed runs per benchmark")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for synthetic data")
+    parser.add_argument("-b", "--benchmarks", nargs="+", help="Only run these benchmarks")
+    parser.add_argument("-o", "--output", help="Write results to JSON file")
+    parser.add_argument("-c", "--compare", help="Baseline results JSON file to compare against")
+    parser.add_argument("-t", "--threshold", type=float, default=1.2, help="Slowdown ratio counted as a regression")
+    return parser
+
+
+def run(scale=1000, repeat=5, seed=0, benchmarks=None, output=None, compare_to=None, threshold=1.2):
+    names = benchmarks or list(BENCHMARKS)
+    unknown = set(names) - set(BENCHMARKS)
+    if unknown:
+        raise ValueError(f"Unknown benchmarks: {', '.join(sorted(unknown))}")
+
+    results = {}
+    with tempfile.TemporaryDirectory() as folder:
+        data = Data(scale, seed, folder)
+        for name in names:
+            function, limit = BENCHMARKS[name]
+            print(f"Running {name}", end="", flush=True)
+            try:
+                result = time_benchmark(function, data, repeat)
+            except Exception as exc:
+                print(f": failed ({exc})")
+                results[name] = {"error": str(exc)}
+                continue
+            if limit:
+                result["scale"] = min(scale, limit)
+            results[name] = result
+            print(f": {result['median']:.4f}s median")
+        session.remove()
+
+    report = {
+        "commit": git_commit(),
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "scale": scale,
+        "seed": seed,
+        "results": results,
+    }
+
+    if output:
+        print(f"Writing results to: {output}")
+        with open(output, "w") as fp:
+            json.dump(report, fp, indent=2)
+
+    failed = [name for name, result in results.items() if "error" in result]
+    regressions = []
+    if compare_to:
+        with open(compare_to) as fp:
+            baseline = json.load(fp)
+        if baseline.get("scale") != scale:
+            print(f"Warning: baseline scale {baseline.get('scale')} differs from {scale}")
+        regressions = compare(results, baseline["results"], threshold)
+        if regressions:
+            print(f"Regressions over {threshold}x: {', '.join(regressions)}")
+
+    return report, failed, regressions
+
+
+def main():
+    parser = get_parser()
+    args = parser.parse_args()
+    _, failed, regressions = run(
+        scale=args.scale,
+        repeat=args.repeat,
+        seed=args.seed,
+        benchmarks=args.benchmarks,
+        output=args.output,
+        compare_to=args.compare,
+        threshold=args.threshold,
+    )
+    if failed or regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""Offline stand-ins for external programs, dispatched on the program name.
+
+Symlinks named mafft, linsi, muscle, FastTree and iqtree point here. They
+accept the arguments fungphy passes, and produce output of the right shape
+instantly: aligners pad sequences to equal length, tree programs print a
+caterpillar tree of the input headers.
+"""
+
+import sys
+
+from pathlib import Path
+
+
+def read_fasta(lines):
+    records, header, body = [], None, []
+    for line in lines:
+        line = line.strip()
+        if line.startswith(">"):
+            if header is not None:
+                records.append((header, "".join(body)))
+            header, body = line[1:], []
+        elif line:
+            body.append(line)
+    if header is not None:
+        records.append((header, "".join(body)))
+    return records
+
+
+def pad(records):
+    length = max((len(sequence) for _, sequence in records), default=0)
+    return "".join(
+        f">{header}\n{sequence.ljust(length, '-')}\n" for header, sequence in records
+    )
+
+
+def caterpillar(headers):
+    if len(headers) < 3:
+        return "(" + ",".join(f"{h}:0.1" for h in headers) + ");"
+    newick = f"({headers[0]}:0.1,{headers[1]}:0.1)1.000:0.01"
+    for header in headers[2:-1]:
+        newick = f"({newick},{header}:0.1)1.000:0.01"
+    return f"({newick},{headers[-1]}:0.1);"
+
+
+def main():
+    program = Path(sys.argv[0]).name
+    args = sys.argv[1:]
+
+    if program in ("mafft", "linsi"):
+        with open(args[-1]) as fp:
+            sys.stdout.write(pad(read_fasta(fp)))
+    elif program == "muscle":
+        with open(args[args.index("-in") + 1]) as fp:
+            sys.stdout.write(pad(read_fasta(fp)))
+    elif program == "FastTree":
+        headers = [header for header, _ in read_fasta(sys.stdin)]
+        print(caterpillar(headers))
+    elif program == "iqtree":
+        with open(args[args.index("-s") + 1]) as fp:
+            headers = [header for header, _ in read_fasta(fp)]
+        prefix = args[args.index("-pre") + 1]
+        Path(f"{prefix}.treefile").write_text(caterpillar(headers) + "\n")
+    else:
+        sys.exit(f"Unknown stub program: {program}")
+
+
+if __name__ == "__main__":
+    main()
@@ -16,6 +16,13 @@ def create_app():
     from fungphy.views import view
     app.register_blueprint(view)
 
+    from fungphy import metrics
+    metrics.init_app(app)
+
+    if os.getenv("FUNGPHY_SQL_STATS"):
+        from fungphy import sqlstats
+        sqlstats.init_app(app)
+
     from fungphy.admin import admin
     admin.init_app(app)
 
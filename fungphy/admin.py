@@ -2,6 +2,7 @@ from flask import Blueprint
 from flask_admin import Admin, BaseView, expose
 from flask_admin.contrib.sqla import ModelView
 from flask_admin.model.form import InlineFormAdmin
+from wtforms import TextAreaField
 
 from fungphy.database import session
 from fungphy.models import (
@@ -24,6 +25,8 @@ class MyView(BaseView):
 
 class MarkerView(ModelView):
     form_columns = ("id", "marker_type", "accession", "sequence")
+    # Marker.sequence is stored in MarkerSequence, so is not a column of Marker
+    form_extra_fields = {"sequence": TextAreaField("Sequence")}
     form_widget_args = {
         "id": {
             "placeholder": "new id will be autocreated",
@@ -0,0 +1,137 @@
+"""Checkpoint pipeline stages in a work directory.
+
+Each stage result is stored alongside the hash of everything it was computed
+from (sequences, tool, parameters). When a stage is run again with the same
+hash and its file still exists, the stored result is loaded instead, so only
+stages whose inputs changed are recomputed.
+
+The hashes are kept in checkpoints.json in the work directory:
+    {"align:ITS": "3f2a...", "tree": "9b1c...", ...}
+"""
+
+import hashlib
+import json
+
+from pathlib import Path
+
+from fungphy import msafile
+from fungphy import writers
+
+
+MANIFEST = "checkpoints.json"
+
+
+def digest(*parts):
+    """Hash JSON-serialisable parts into a hex digest."""
+    sha = hashlib.sha256()
+    for part in parts:
+        sha.update(json.dumps(part, sort_keys=True, default=str).encode())
+        sha.update(b"\0")
+    return sha.hexdigest()
+
+
+def digest_sequences(sequences):
+    """Hash a list of Sequence objects by header and sequence."""
+    sha = hashlib.sha256()
+    for sequence in sequences:
+        sha.update(f">{sequence.header}\n{sequence.sequence}\n".encode())
+    return sha.hexdigest()
+
+
+def digest_msa(msa):
+    """Hash an MSA or MultiMSA, including its partition layout."""
+    sha = hashlib.sha256()
+    for chunk in writers.iter_raxml_partitions(msa):
+        sha.update(chunk.encode())
+    for chunk in writers.iter_fasta(msa):
+        sha.update(chunk.encode())
+    return sha.hexdigest()
+
+
+class Checkpoints:
+    """Stage results in a work directory, keyed by a hash of their inputs.
+
+    If path is None, checkpointing is disabled and every stage is computed.
+    force recomputes every stage; invalidate is a list of stage names to
+    recompute, where a name without a colon also matches its sub-stages
+    (e.g. "align" matches "align:ITS").
+    """
+
+    def __init__(self, path=None, force=False, invalidate=None):
+        self.path = Path(path) if path else None
+        self.force = force
+        self.invalidate = set(invalidate or [])
+        self.manifest = {}
+        if self.path:
+            self.path.mkdir(parents=True, exist_ok=True)
+            manifest = self.path / MANIFEST
+            if manifest.exists():
+                with manifest.open() as fp:
+                    self.manifest = json.load(fp)
+
+    @property
+    def enabled(self):
+        return self.path is not None
+
+    def file(self, stage, suffix):
+        return self.path / f"{stage.replace(':', '.')}{suffix}"
+
+    def is_stale(self, stage, key, suffix):
+        if self.force:
+            return True
+        if stage in self.invalidate or stage.split(":")[0] in self.invalidate:
+            return True
+        return self.manifest.get(stage) != key or not self.file(stage, suffix).exists()
+
+    def record(self, stage, key):
+        self.manifest[stage] = key
+        with (self.path / MANIFEST).open("w") as fp:
+            json.dump(self.manifest, fp, indent=2, sort_keys=True)
+
+    def run(self, stage, key, compute, save, load, suffix):
+        """Load a stage result if its checkpoint is current, else compute it.
+
+        key is a digest, or a function returning one, which is only called
+        if checkpointing is enabled. save(path, result) writes a computed
+        result; load(path) reads it.
+        """
+        if not self.enabled:
+            return compute()
+        if callable(key):
+            key = key()
+        path = self.file(stage, suffix)
+        if not self.is_stale(stage, key, suffix):
+            print(f"Skipping {stage}: checkpoint is up to date ({path})")
+            return load(path)
+        result = compute()
+        save(path, result)
+        self.record(stage, key)
+        return result
+
+    def msa(self, stage, key, compute):
+        """Checkpoint a stage returning an MSA, stored in binary format."""
+
+        def load(path):
+            mmsa = msafile.load(path)
+            return mmsa[0]
+
+        return self.run(stage, key, compute, msafile.save, load, msafile.EXTENSION)
+
+    def text(self, stage, key, compute):
+        """Checkpoint a stage returning a string, e.g. a Newick tree."""
+        return self.run(
+            stage, key, compute, Path.write_text, Path.read_text, ".txt"
+        )
+
+    def data(self, stage, key, compute):
+        """Checkpoint a stage returning a JSON-serialisable object."""
+
+        def save(path, result):
+            with path.open("w") as fp:
+                json.dump(result, fp)
+
+        def load(path):
+            with path.open() as fp:
+                return json.load(fp)
+
+        return self.run(stage, key, compute, save, load, ".json")
@@ -0,0 +1,559 @@
+"""Compact array-backed trees for operations on large phylogenies.
+
+A CompactTree stores nodes as integer indices in preorder, so a parent always
+precedes its children and iterating indices in reverse is a postorder. Per-node
+data lives in flat arrays:
+
+    parent      index of parent node, -1 for the root
+    offsets     children of node i are children[offsets[i]:offsets[i + 1]]
+    children    child indices, grouped by parent in sibling order
+    length      branch length to parent, NaN if absent
+    support     support of the branch to parent, NaN if absent
+    name        index into the name table, -1 if unnamed
+
+Trees are treated as immutable; rerooting, ladderizing and pruning build new
+arrays in a single traversal. ete3 is only imported to convert for rendering.
+"""
+
+import math
+import re
+
+from array import array
+from collections import defaultdict
+
+
+TOKEN = re.compile(r"\s*(\[[^\]]*\]|'(?:[^']|'')*'|[(),:;]|[^\s(),:;\[\]']+)")
+
+NAN = float("nan")
+
+
+def _unquote(label):
+    if label.startswith("'"):
+        return label[1:-1].replace("''", "'")
+    return label
+
+
+def _quote(label):
+    if re.search(r"[\s(),:;\[\]']", label):
+        return "'" + label.replace("'", "''") + "'"
+    return label
+
+
+class CompactTree:
+    """A rooted tree stored in preorder flat arrays."""
+
+    def __init__(self, parent, length, support, name, names):
+        self.parent = parent
+        self.length = length
+        self.support = support
+        self.name = name
+        self.names = names
+        self._index_children()
+
+    def _index_children(self):
+        """Build the children/offsets arrays from the parent array."""
+        size = len(self.parent)
+        counts = array("i", bytes(4 * (size + 1)))
+        for p in self.parent:
+            if p >= 0:
+                counts[p + 1] += 1
+        for i in range(size):
+            counts[i + 1] += counts[i]
+        self.offsets = counts
+        self.children = array("i", bytes(4 * max(size - 1, 0)))
+        fill = array("i", counts)
+        for i in range(1, size):
+            p = self.parent[i]
+            self.children[fill[p]] = i
+            fill[p] += 1
+
+    def __len__(self):
+        return len(self.parent)
+
+    def get_children(self, node):
+        return self.children[self.offsets[node] : self.offsets[node + 1]]
+
+    def is_leaf(self, node):
+        return self.offsets[node] == self.offsets[node + 1]
+
+    def get_name(self, node):
+        index = self.name[node]
+        return self.names[index] if index >= 0 else None
+
+    def iter_leaves(self):
+        for node in range(len(self)):
+            if self.offsets[node] == self.offsets[node + 1]:
+                yield node
+
+    def get_leaf_names(self):
+        return [self.get_name(node) for node in self.iter_leaves()]
+
+    def leaf_counts(self):
+        """Number of leaves beneath each node."""
+        counts = array("i", bytes(4 * len(self)))
+        for node in range(len(self) - 1, -1, -1):
+            if self.is_leaf(node):
+                counts[node] += 1
+            if node:
+                counts[self.parent[node]] += counts[node]
+        return counts
+
+    def find(self, name):
+        """Return the index of the first node with a given name."""
+        for node in range(len(self)):
+            index = self.name[node]
+            if index >= 0 and self.names[index] == name:
+                return node
+        raise KeyError(f"No node named: {name}")
+
+    def mrca(self, nodes):
+        """Most recent common ancestor of the given node indices."""
+        nodes = list(nodes)
+        if not nodes:
+            raise ValueError("Expected at least one node")
+        ancestors = set()
+        node = nodes[0]
+        while node >= 0:
+            ancestors.add(node)
+            node = self.parent[node]
+        # Preorder indices increase with depth along any path, so the deepest
+        # shared ancestor of all nodes is the largest common index.
+        common = ancestors
+        for node in nodes[1:]:
+            path = set()
+            while node >= 0:
+                path.add(node)
+                node = self.parent[node]
+            common &= path
+        return max(common)
+
+    def group_clades(self, groups):
+        """Find the MRCA and first leaf of every group in one postorder pass.
+
+        `groups` maps leaf names to group names (e.g. taxonomic sections).
+        Returns a dict of group: (MRCA, first leaf, monophyletic) of node
+        indices, in order of first appearance in the tree.
+        """
+        totals = defaultdict(int)
+        for group in groups.values():
+            totals[group] += 1
+
+        first = {}
+        for node in self.iter_leaves():
+            group = groups.get(self.get_name(node))
+            if group and group not in first:
+                first[group] = node
+
+        sizes = self.leaf_counts()
+        counts = [None] * len(self)
+        clades = {}
+        for node in range(len(self) - 1, -1, -1):
+            if self.is_leaf(node):
+                group = groups.get(self.get_name(node))
+                merged = {group: 1} if group else {}
+                changed = list(merged)
+            else:
+                kids = sorted(
+                    (counts[child] for child in self.get_children(node)),
+                    key=len,
+                    reverse=True,
+                )
+                merged, changed = kids[0], []
+                for other in kids[1:]:
+                    for group, count in other.items():
+                        merged[group] = merged.get(group, 0) + count
+                        changed.append(group)
+                for child in self.get_children(node):
+                    counts[child] = None
+            for group in dict.fromkeys(changed):
+                if merged[group] == totals[group]:
+                    del merged[group]
+                    clades[group] = node, sizes[node] == totals[group]
+            counts[node] = merged
+
+        return {
+            group: (clades[group][0], leaf, clades[group][1])
+            for group, leaf in first.items()
+        }
+
+    @classmethod
+    def _build(cls, root, get_children, get_length, get_support, get_name, names):
+        """Build a CompactTree by a preorder walk over arbitrary node keys."""
+        parent, length, support, name = (
+            array("i"), array("d"), array("d"), array("i")
+        )
+        stack = [(root, -1)]
+        while stack:
+            key, up = stack.pop()
+            index = len(parent)
+            parent.append(up)
+            length.append(get_length(key))
+            support.append(get_support(key))
+            name.append(get_name(key))
+            for child in reversed(get_children(key)):
+                stack.append((child, index))
+        return cls(parent, length, support, name, names)
+
+    def ladderize(self, direction=0):
+        """Sort children by their number of leaves, as ete3's ladderize."""
+        sizes = self.leaf_counts()
+
+        def get_children(node):
+            kids = sorted(self.get_children(node), key=sizes.__getitem__)
+            if direction == 1:
+                kids.reverse()
+            return kids
+
+        return self._build(
+            0,
+            get_children,
+            self.length.__getitem__,
+            self.support.__getitem__,
+            self.name.__getitem__,
+            self.names,
+        )
+
+    def prune(self, leaves):
+        """Keep only the given leaf names, suppressing unary nodes.
+
+        Branch lengths of suppressed nodes are added to their remaining
+        child, which keeps its own support. Runs in linear time.
+        """
+        leaves = set(leaves)
+        keep = array("i", bytes(4 * len(self)))
+        for node in range(len(self) - 1, -1, -1):
+            if self.is_leaf(node) and self.get_name(node) in leaves:
+                keep[node] += 1
+            if node and keep[node]:
+                keep[self.parent[node]] += 1
+        if not keep[0]:
+            raise ValueError("None of the given leaves are in the tree")
+
+        extra = {}
+
+        def descend(node):
+            # Follow a chain of unary nodes down to the next kept branch point
+            added = 0.0
+            while not self.is_leaf(node):
+                kids = [c for c in self.get_children(node) if keep[c]]
+                if len(kids) != 1:
+                    break
+                if not math.isnan(self.length[node]):
+                    added += self.length[node]
+                node = kids[0]
+            if added:
+                extra[node] = added
+            return node
+
+        def get_children(node):
+            return [descend(c) for c in self.get_children(node) if keep[c]]
+
+        def get_length(node):
+            value = self.length[node]
+            if node in extra:
+                value = extra[node] if math.isnan(value) else value + extra[node]
+            return value
+
+        root = 0
+        while not self.is_leaf(root):
+            kids = [c for c in self.get_children(root) if keep[c]]
+            if len(kids) != 1:
+                break
+            root = kids[0]
+
+        pruned = self._build(
+            root,
+            get_children,
+            get_length,
+            self.support.__getitem__,
+            self.name.__getitem__,
+            self.names,
+        )
+        pruned.length[0] = NAN
+        return pruned
+
+    def graft(self, placements):
+        """Attach new leaves next to existing ones.
+
+        `placements` maps existing leaf names to lists of new leaf names. Each
+        existing leaf is replaced by a ladder of cherries holding it and its
+        new neighbours, keeping the tree binary. The existing leaf keeps its
+        branch length, as does each new leaf; new internal nodes get zero.
+        """
+        if not placements:
+            return self
+
+        lookup = {}
+        names = list(self.names)
+        for new in placements.values():
+            for name in new:
+                if name not in lookup:
+                    lookup[name] = len(names)
+                    names.append(name)
+
+        def get_children(key):
+            kind, node, depth = key
+            if kind == "new":
+                return []
+            if kind == "cherry":
+                below = ("cherry", node, depth - 1) if depth > 1 else ("old", node, 0)
+                return [below, ("new", node, depth)]
+            kids = []
+            for child in self.get_children(node):
+                new = placements.get(self.get_name(child))
+                if self.is_leaf(child) and new:
+                    kids.append(("cherry", child, len(new)))
+                else:
+                    kids.append(("old", child, 0))
+            return kids
+
+        def get_length(key):
+            kind, node, depth = key
+            if kind == "cherry":
+                return 0.0
+            return self.length[node]
+
+        def get_support(key):
+            kind, node, depth = key
+            return self.support[node] if kind == "old" else NAN
+
+        def get_name(key):
+            kind, node, depth = key
+            if kind == "new":
+                return lookup[placements[self.get_name(node)][depth - 1]]
+            if kind == "cherry":
+                return -1
+            return self.name[node]
+
+        return self._build(
+            ("old", 0, 0), get_children, get_length, get_support, get_name, names
+        )
+
+    def set_outgroup(self, outgroup):
+        """Reroot on the branch above a node, or above the MRCA of leaf names.
+
+        Follows ete3's set_outgroup: a binary root is suppressed, the new
+        root splits the outgroup branch in half, and branches that change
+        direction carry their length and support to the new child node.
+        """
+        if not isinstance(outgroup, int):
+            if isinstance(outgroup, str):
+                outgroup = [outgroup]
+            outgroup = self.mrca(self.find(name) for name in outgroup)
+        if outgroup == 0:
+            raise ValueError("Cannot set the root as outgroup")
+
+        # Undirected neighbour lists; children first, then the parent, so
+        # nodes that flip direction gain their old parent as the last child
+        neighbours = [list(self.get_children(node)) for node in range(len(self))]
+        for node in range(1, len(self)):
+            neighbours[node].append(self.parent[node])
+        edges = {}
+        for node in range(1, len(self)):
+            edges[node, self.parent[node]] = (self.length[node], self.support[node])
+            edges[self.parent[node], node] = edges[node, self.parent[node]]
+
+        path = set()
+        node = outgroup
+        while node >= 0:
+            path.add(node)
+            node = self.parent[node]
+
+        root_children = self.get_children(0)
+        if len(root_children) == 2:
+            a, b = root_children
+            outer = b if a in path else a
+            joined = (
+                _add(self.length[a], self.length[b]),
+                self.support[outer],
+            )
+            neighbours[a][neighbours[a].index(0)] = b
+            neighbours[b][neighbours[b].index(0)] = a
+            edges[a, b] = edges[b, a] = joined
+
+        other = neighbours[outgroup][-1]
+        split_length = edges[outgroup, other][0]
+        split_support = self.support[outgroup]
+        half = split_length / 2
+        new_root = -1
+
+        def get_children(key):
+            node, up = key
+            if node == new_root:
+                return [(outgroup, new_root), (other, new_root)]
+            return [
+                (n, node)
+                for n in neighbours[node]
+                if n != up and not (node in (outgroup, other) and n in (outgroup, other))
+            ]
+
+        def get_edge(key, field):
+            node, up = key
+            if node == new_root:
+                return NAN
+            if up == new_root:
+                return half if field == 0 else split_support
+            return edges[node, up][field]
+
+        return self._build(
+            (new_root, None),
+            get_children,
+            lambda key: get_edge(key, 0),
+            lambda key: get_edge(key, 1),
+            lambda key: self.name[key[0]] if key[0] >= 0 else -1,
+            self.names,
+        )
+
+    @classmethod
+    def from_newick(cls, newick):
+        """Parse a Newick string.
+
+        Internal node labels are read as support values if numeric, and as
+        names otherwise. Comments in square brackets are ignored.
+        """
+        parent, length, support, name = (
+            array("i"), array("d"), array("d"), array("i")
+        )
+        names, lookup = [], {}
+        stack = []
+        current = -1
+        expect_node = True
+        expect_length = False
+
+        def new_node():
+            parent.append(stack[-1] if stack else -1)
+            length.append(NAN)
+            support.append(NAN)
+            name.append(-1)
+            return len(parent) - 1
+
+        def set_name(node, label):
+            if label not in lookup:
+                lookup[label] = len(names)
+                names.append(label)
+            name[node] = lookup[label]
+
+        for match in TOKEN.finditer(newick):
+            token = match.group(1)
+            if token.startswith("["):
+                continue
+            if expect_length:
+                length[current] = float(token)
+                expect_length = False
+            elif token == "(":
+                current = new_node()
+                stack.append(current)
+            elif token == ",":
+                if expect_node:
+                    new_node()
+                expect_node = True
+            elif token == ")":
+                if expect_node:
+                    new_node()
+                current = stack.pop()
+                expect_node = False
+            elif token == ":":
+                if expect_node:
+                    current = new_node()
+                    expect_node = False
+                expect_length = True
+            elif token == ";":
+                break
+            elif expect_node:
+                current = new_node()
+                set_name(current, _unquote(token))
+                expect_node = False
+            else:
+                try:
+                    support[current] = float(token)
+                except ValueError:
+                    set_name(current, _unquote(token))
+
+        if stack:
+            raise ValueError("Unbalanced parentheses in Newick string")
+        return cls(parent, length, support, name, names)
+
+    @classmethod
+    def from_newick_file(cls, path):
+        with open(path) as fp:
+            return cls.from_newick(fp.read())
+
+    def write(self, supports=True, lengths=True, precision=6):
+        """Write the tree as a Newick string."""
+        out = []
+        stack = [0]
+        while stack:
+            item = stack.pop()
+            if item is None:
+                out.append(",")
+                continue
+            node = ~item if item < 0 else item
+            if item >= 0 and not self.is_leaf(node):
+                out.append("(")
+                stack.append(~node)
+                kids = self.get_children(node)
+                for i, child in enumerate(reversed(kids)):
+                    if i:
+                        stack.append(None)
+                    stack.append(child)
+                continue
+            if item < 0:
+                out.append(")")
+            label = self.get_name(node)
+            if label is not None:
+                out.append(_quote(label))
+            elif supports and item < 0 and node and not math.isnan(self.support[node]):
+                out.append(f"{self.support[node]:.{precision}g}")
+            if lengths and node and not math.isnan(self.length[node]):
+                out.append(f":{self.length[node]:.{precision}g}")
+        out.append(";")
+        return "".join(out)
+
+    @classmethod
+    def from_ete(cls, tree):
+        """Convert an ete3 Tree."""
+        names, lookup = [], {}
+
+        def get_name(node):
+            if not node.name:
+                return -1
+            if node.name not in lookup:
+                lookup[node.name] = len(names)
+                names.append(node.name)
+            return lookup[node.name]
+
+        return cls._build(
+            tree,
+            lambda node: node.children,
+            lambda node: float(node.dist),
+            lambda node: float(node.support),
+            get_name,
+            names,
+        )
+
+    def to_ete(self):
+        """Convert to an ete3 Tree, e.g. for annotation and rendering."""
+        from ete3 import Tree
+
+        nodes = [Tree() for _ in range(len(self))]
+        for i, node in enumerate(nodes):
+            label = self.get_name(i)
+            if label is not None:
+                node.name = label
+            if not math.isnan(self.length[i]):
+                node.dist = self.length[i]
+            if not math.isnan(self.support[i]):
+                node.support = self.support[i]
+            if i:
+                up = nodes[self.parent[i]]
+                up.children.append(node)
+                node.up = up
+        return nodes[0]
+
+
+def _add(a, b):
+    if math.isnan(a):
+        return b
+    if math.isnan(b):
+        return a
+    return a + b
@@ -0,0 +1,275 @@
+"""Compare phylogenetic trees by their bipartitions.
+
+Trees are reduced to sets of bipartitions (splits), each stored as an integer
+bitset over a shared leaf index. A split and its complement describe the same
+edge, so splits are canonicalised to the side that excludes the first leaf.
+Comparing trees then only needs set operations on small integers.
+"""
+
+import argparse
+
+from collections import Counter
+
+from ete3 import Tree
+
+from fungphy.compact import CompactTree
+
+
+def leaf_index(*trees):
+    """Map each leaf name in the given Trees to a bit position."""
+    names = set()
+    for tree in trees:
+        names.update(tree.get_leaf_names())
+    return {name: i for i, name in enumerate(sorted(names))}
+
+
+def clade_bitsets(tree, index):
+    """Compute the leaf bitset of every node in one postorder pass.
+
+    Each leaf sets the bit given by `index`; internal nodes take the union
+    of their children, so identical clades in different trees share a key.
+    """
+    bitsets = {}
+    for node in tree.traverse("postorder"):
+        if node.is_leaf():
+            bitsets[node] = 1 << index[node.name]
+        else:
+            bits = 0
+            for child in node.children:
+                bits |= bitsets[child]
+            bitsets[node] = bits
+    return bitsets
+
+
+def bipartitions(tree, index):
+    """Return the set of non-trivial, canonical bipartitions of a Tree."""
+    full = (1 << len(index)) - 1
+    size = len(index)
+    splits = set()
+    for bits in clade_bitsets(tree, index).values():
+        if bits & 1:
+            bits ^= full
+        count = bin(bits).count("1")
+        if 1 < count < size - 1:
+            splits.add(bits)
+    return frozenset(splits)
+
+
+def bit_positions(bits):
+    """Yield the positions of set bits in increasing order.
+
+    Only the set bits are visited, so listing a small split of a large tree
+    doesn't shift the bitset once per leaf.
+    """
+    while bits:
+        low = bits & -bits
+        yield low.bit_length() - 1
+        bits ^= low
+
+
+def split_leaves(bits, names):
+    """Return leaf names of a bitset, given names in index order."""
+    return [names[i] for i in bit_positions(bits)]
+
+
+def common_leaves(trees):
+    """Prune Trees to the leaves they all share.
+
+    Returns the Trees, pruned copies where leaves were removed, and the
+    sorted names of leaves that were removed from any tree.
+    """
+    leaf_sets = [set(tree.get_leaf_names()) for tree in trees]
+    common = set.intersection(*leaf_sets)
+    if not common:
+        raise ValueError("Trees have no leaves in common")
+    pruned = [
+        tree if leaves == common else CompactTree.from_ete(tree).prune(common).to_ete()
+        for tree, leaves in zip(trees, leaf_sets)
+    ]
+    return pruned, sorted(set.union(*leaf_sets) - common)
+
+
+class TreeSet:
+    """A collection of Trees reduced to bipartitions over a shared leaf index.
+
+    Trees with different leaf sets are pruned to the leaves they all share;
+    the names of removed leaves are kept in `dropped`.
+    """
+
+    def __init__(self, trees):
+        trees = list(trees)
+        if not trees:
+            raise ValueError("Expected at least one tree")
+        self.trees, self.dropped = common_leaves(trees)
+        self.index = leaf_index(self.trees[0])
+        self.names = sorted(self.index, key=self.index.get)
+        self.splits = [bipartitions(tree, self.index) for tree in self.trees]
+
+    def __len__(self):
+        return len(self.trees)
+
+    @property
+    def max_rf(self):
+        """Maximum RF distance between two unrooted binary trees."""
+        return max(2 * (len(self.index) - 3), 1)
+
+    def rf_distance(self, i, j, normalize=False):
+        a, b = self.splits[i], self.splits[j]
+        distance = len(a) + len(b) - 2 * len(a & b)
+        return distance / self.max_rf if normalize else distance
+
+    def rf_matrix(self, normalize=False):
+        """Pairwise Robinson-Foulds distance matrix."""
+        size = len(self)
+        matrix = [[0] * size for _ in range(size)]
+        for i in range(size):
+            for j in range(i + 1, size):
+                matrix[i][j] = matrix[j][i] = self.rf_distance(i, j, normalize)
+        return matrix
+
+    def frequencies(self):
+        """Proportion of trees containing each bipartition."""
+        counts = Counter(split for splits in self.splits for split in splits)
+        total = len(self)
+        return {split: count / total for split, count in counts.items()}
+
+    def clade_frequencies(self):
+        """List (leaf names, frequency) per bipartition, most frequent first."""
+        return [
+            (split_leaves(split, self.names), frequency)
+            for split, frequency in sorted(
+                self.frequencies().items(), key=lambda item: (-item[1], item[0])
+            )
+        ]
+
+    def consensus(self, threshold=0.5, strict=False):
+        """Build a consensus Tree from bipartitions above a frequency threshold.
+
+        Majority-rule consensus keeps splits found in more than `threshold`
+        of trees; strict consensus keeps only those found in every tree.
+        Support values are set to the percentage of trees containing a split.
+        """
+        if threshold < 0.5:
+            raise ValueError("Threshold must be at least 0.5 for compatible splits")
+
+        selected = [
+            (split, frequency)
+            for split, frequency in self.frequencies().items()
+            if (frequency == 1.0 if strict else frequency > threshold)
+        ]
+        selected.sort(key=lambda item: -bin(item[0]).count("1"))
+
+        # Splits exclude the first leaf, so each is a clade when rooted on it;
+        # compatible clades are nested or disjoint, so adding the largest
+        # first always places a clade under the deepest node of its leaves.
+        root = Tree()
+        deepest = [root] * len(self.names)
+        for split, frequency in selected:
+            members = list(bit_positions(split))
+            node = deepest[members[0]].add_child()
+            node.support = frequency * 100
+            for i in members:
+                deepest[i] = node
+        for i, name in enumerate(self.names):
+            deepest[i].add_child(name=name)
+        return root
+
+    def annotate(self, tree):
+        """Set support of each internal node of a Tree to its split frequency."""
+        frequencies = self.frequencies()
+        full = (1 << len(self.index)) - 1
+        for node, bits in clade_bitsets(tree, self.index).items():
+            if node.is_leaf() or node.is_root():
+                continue
+            if bits & 1:
+                bits ^= full
+            node.support = frequencies.get(bits, 0.0) * 100
+        return tree
+
+    @classmethod
+    def from_paths(cls, paths):
+        return cls(tree for path in paths for tree in read_trees(path))
+
+
+def read_trees(path):
+    """Read Newick trees from a file, one per line."""
+    with open(path) as fp:
+        return [Tree(line.strip()) for line in fp if line.strip()]
+
+
+def format_matrix(matrix, labels, delimiter="\t"):
+    rows = [delimiter.join(["", *labels])]
+    for label, row in zip(labels, matrix):
+        rows.append(delimiter.join([label, *(f"{value:g}" for value in row)]))
+    return "\n".join(rows)
+
+
+def get_parser():
+    parser = argparse.ArgumentParser("fungphy-compare")
+    parser.add_argument("trees", nargs="+", help="Newick tree file/s, one tree per line")
+    parser.add_argument("-rf", "--rf_out", help="Output RF distance matrix file")
+    parser.add_argument("-n", "--normalize", action="store_true", help="Normalise RF distances")
+    parser.add_argument("-c", "--consensus", choices=["majority", "strict"], help="Build a consensus tree")
+    parser.add_argument("-t", "--threshold", type=float, default=0.5, help="Majority-rule split frequency threshold")
+    parser.add_argument("-co", "--consensus_out", help="Output consensus tree file")
+    parser.add_argument("-fo", "--frequencies_out", help="Output clade frequency table")
+    return parser
+
+
+def compare(
+    trees,
+    rf_out=None,
+    normalize=False,
+    consensus=None,
+    threshold=0.5,
+    consensus_out=None,
+    frequencies_out=None,
+):
+    labels, loaded = [], []
+    for path in trees:
+        for i, tree in enumerate(read_trees(path), 1):
+            labels.append(f"{path}:{i}")
+            loaded.append(tree)
+    tree_set = TreeSet(loaded)
+    print(f"Loaded {len(tree_set)} trees with {len(tree_set.names)} leaves")
+    if tree_set.dropped:
+        print(
+            f"Compared on common leaves only; left out {len(tree_set.dropped)}:"
+            f" {', '.join(tree_set.dropped)}"
+        )
+
+    if rf_out:
+        print(f"Writing RF distance matrix to: {rf_out}")
+        with open(rf_out, "w") as fp:
+            fp.write(format_matrix(tree_set.rf_matrix(normalize=normalize), labels))
+
+    if frequencies_out:
+        print(f"Writing clade frequencies to: {frequencies_out}")
+        with open(frequencies_out, "w") as fp:
+            fp.write(
+                "\n".join(
+                    f"{frequency:g}\t{','.join(leaves)}"
+                    for leaves, frequency in tree_set.clade_frequencies()
+                )
+            )
+
+    tree = None
+    if consensus:
+        tree = tree_set.consensus(threshold=threshold, strict=consensus == "strict")
+        if consensus_out:
+            print(f"Writing {consensus} consensus tree to: {consensus_out}")
+            tree.write(format=0, outfile=consensus_out)
+        else:
+            print(tree.write(format=0))
+
+    return tree_set, tree
+
+
+def main():
+    parser = get_parser()
+    args = parser.parse_args()
+    compare(**vars(args))
+
+
+if __name__ == "__main__":
+    main()
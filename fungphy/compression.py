@@ -0,0 +1,130 @@
+"""Compact storage of nucleotide sequences.
+
+Sequences are packed at 2 bits per base. Any other characters (ambiguity
+codes, gaps, lowercase) are kept in a side table of runs, so packing is
+lossless. Sequences that are mostly not ACGT are zlib compressed instead.
+
+    packed = encode("ACGTNNNNACGT")
+    decode(packed)  # "ACGTNNNNACGT"
+
+Packed values start with a codec byte:
+    0x01  2-bit: <II length, run count>, run starts (<u4), run lengths (<u4),
+          run characters (u1), then 4 bases per byte, first base in the high bits
+    0x02  zlib compressed ASCII
+"""
+
+import struct
+import zlib
+
+from sqlalchemy.types import LargeBinary, TypeDecorator
+
+
+TWO_BIT = 1
+ZLIB = 2
+HEADER = struct.Struct("<BII")
+BASES = b"ACGT"
+
+
+def _lookup():
+    import numpy as np
+
+    codes = np.full(256, 255, dtype=np.uint8)
+    codes[np.frombuffer(BASES, dtype=np.uint8)] = np.arange(4, dtype=np.uint8)
+    return codes
+
+
+def encode(sequence):
+    """Pack a sequence string into bytes."""
+    import numpy as np
+
+    try:
+        raw = sequence.encode("ascii")
+    except UnicodeEncodeError:
+        raw = None
+    if raw is None:
+        return bytes([ZLIB]) + zlib.compress(sequence.encode("utf-8"))
+
+    array = np.frombuffer(raw, dtype=np.uint8)
+    codes = _lookup()[array]
+    other = np.flatnonzero(codes == 255)
+
+    # Runs of identical non-ACGT characters, e.g. a stretch of Ns
+    starts = lengths = chars = np.empty(0, dtype=np.uint32)
+    if other.size:
+        if other.size * 2 > array.size:
+            return bytes([ZLIB]) + zlib.compress(raw)
+        values = array[other]
+        breaks = (np.diff(other) != 1) | (np.diff(values) != 0)
+        first = np.concatenate(([0], np.flatnonzero(breaks) + 1))
+        starts = other[first].astype("<u4")
+        lengths = np.diff(np.append(first, other.size)).astype("<u4")
+        chars = values[first].astype(np.uint8)
+        codes[other] = 0
+
+    padded = np.zeros(-(-codes.size // 4) * 4, dtype=np.uint8)
+    padded[: codes.size] = codes
+    quads = padded.reshape(-1, 4)
+    packed = (quads[:, 0] << 6) | (quads[:, 1] << 4) | (quads[:, 2] << 2) | quads[:, 3]
+
+    return b"".join(
+        (
+            HEADER.pack(TWO_BIT, array.size, starts.size),
+            starts.tobytes(),
+            lengths.tobytes(),
+            chars.tobytes(),
+            packed.astype(np.uint8).tobytes(),
+        )
+    )
+
+
+def decode(packed):
+    """Unpack bytes made by encode() back into a sequence string.
+
+    Strings are returned unchanged, so values stored before packing was
+    introduced can still be read.
+    """
+    if packed is None or isinstance(packed, str):
+        return packed
+
+    import numpy as np
+
+    packed = bytes(packed)
+    if packed[0] == ZLIB:
+        return zlib.decompress(packed[1:]).decode("utf-8")
+    if packed[0] != TWO_BIT:
+        raise ValueError(f"Unknown sequence codec: {packed[0]}")
+
+    _, length, runs = HEADER.unpack_from(packed)
+    offset = HEADER.size
+    starts = np.frombuffer(packed, dtype="<u4", count=runs, offset=offset)
+    lengths = np.frombuffer(packed, dtype="<u4", count=runs, offset=offset + 4 * runs)
+    chars = np.frombuffer(packed, dtype=np.uint8, count=runs, offset=offset + 8 * runs)
+
+    quads = np.frombuffer(packed, dtype=np.uint8, offset=offset + 9 * runs)
+    codes = np.empty((quads.size, 4), dtype=np.uint8)
+    for i, shift in enumerate((6, 4, 2, 0)):
+        codes[:, i] = (quads >> shift) & 3
+    array = np.frombuffer(BASES, dtype=np.uint8)[codes.ravel()[:length]]
+
+    for start, run, char in zip(starts, lengths, chars):
+        array[start : start + run] = char
+
+    return array.tobytes().decode("ascii")
+
+
+class PackedSequence(TypeDecorator):
+    """Column storing sequences packed by encode().
+
+    Strings are packed when written; values are read back as packed bytes and
+    only decoded when needed (see Marker.sequence).
+    """
+
+    impl = LargeBinary
+
+    def process_bind_param(self, value, dialect):
+        if value is None or isinstance(value, bytes):
+            return value
+        return encode(value)
+
+    def process_result_value(self, value, dialect):
+        return value
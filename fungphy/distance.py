@@ -0,0 +1,327 @@
+"""Pairwise distance matrices from multiple sequence alignments.
+
+Alignments are encoded as uint8 matrices (A, C, G, T = 0-3; anything else,
+including gaps and ambiguity codes, = 4). Per-pair counts of comparable
+sites, identities and transitions are computed as products of one-hot
+matrices, so each block of the distance matrix is a few matrix multiplies.
+Sites that are gaps or ambiguous in either sequence are ignored (pairwise
+deletion).
+
+Sites are processed in chunks, each encoded once for all rows, so memory use
+is the output matrix plus (n, n) float32 counts, whatever the alignment length.
+"""
+
+import numpy as np
+
+import fungphy.phylogeny as phy
+from fungphy.compact import CompactTree
+
+
+MODELS = ("p", "jc69", "k2p")
+
+LOOKUP = np.full(256, 4, dtype=np.uint8)
+for code, bases in enumerate(("Aa", "Cc", "Gg", "TtUu")):
+    for base in bases:
+        LOOKUP[ord(base)] = code
+
+
+def encode(msa):
+    """Encode an MSA or MultiMSA as headers and a uint8 code matrix.
+
+    Alignments loaded from binary files are encoded from their matrix.
+    """
+    matrix = getattr(msa, "matrix", None)
+    if matrix is not None:
+        return list(msa.headers), LOOKUP[matrix]
+    sequences = phy.sequence_map(msa)
+    headers = list(sequences)
+    if not headers:
+        return headers, np.zeros((0, 0), dtype=np.uint8)
+    length = len(sequences[headers[0]])
+    if any(len(sequence) != length for sequence in sequences.values()):
+        raise ValueError("Sequences in alignment differ in length")
+    raw = "".join(sequences[header] for header in headers).encode("ascii", "replace")
+    codes = LOOKUP[np.frombuffer(raw, dtype=np.uint8)]
+    return headers, codes.reshape(len(headers), length)
+
+
+def count_sites(codes, chunk_rows=1024, chunk_sites=512, transitions=False, same=None):
+    """Count comparable sites, identities and transitions between all pairs.
+
+    Sites are processed in chunks, and each chunk is one-hot encoded once
+    and shared by all blocks of rows. As the counts are symmetric, only
+    blocks on or above the diagonal are multiplied, and the rest is
+    mirrored. The four bases (and purines/pyrimidines) are laid side by
+    side, so identities (and same-class sites) take one product per block.
+
+    Returns float32 arrays of shape (n, n) for valid sites and identical
+    sites, plus transitions if requested (else None). Counts are exact up
+    to 2^24 sites. Identities are added to `same` if an (n, n) array of
+    zeros is given.
+    """
+    n, length = codes.shape
+    valid = np.zeros((n, n), dtype=np.float32)
+    if same is None:
+        same = np.zeros_like(valid)
+    ts = np.zeros_like(valid) if transitions else None
+
+    for site in range(0, length, chunk_sites):
+        block = codes[:, site : site + chunk_sites]
+        present = (block < 4).astype(np.float32)
+        bases = np.concatenate([block == base for base in range(4)], axis=1)
+        bases = bases.astype(np.float32)
+        if transitions:
+            # Same class (purine/pyrimidine), including identical bases
+            purine = (block == 0) | (block == 2)
+            pyrimidine = (block == 1) | (block == 3)
+            classes = np.concatenate((purine, pyrimidine), axis=1).astype(np.float32)
+
+        for start in range(0, n, chunk_rows):
+            stop = min(start + chunk_rows, n)
+            valid[start:stop, start:] += present[start:stop] @ present[start:].T
+            same[start:stop, start:] += bases[start:stop] @ bases[start:].T
+            if transitions:
+                ts[start:stop, start:] += classes[start:stop] @ classes[start:].T
+
+    for counts in (valid, same, ts):
+        if counts is None:
+            continue
+        for start in range(0, n, chunk_rows):
+            stop = min(start + chunk_rows, n)
+            counts[stop:, start:stop] = counts[start:stop, stop:].T
+
+    if transitions:
+        ts -= same
+    return valid, same, ts
+
+
+def distances(valid, same, ts=None, model="p"):
+    """Convert site counts to distances under a substitution model.
+
+    Saturated pairs, where the model correction is undefined, are given an
+    infinite distance; pairs with no comparable sites are NaN.
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        p = (valid - same) / valid
+        if model == "p":
+            return p
+        if model == "jc69":
+            d = -0.75 * np.log(1 - 4 / 3 * p)
+        elif model == "k2p":
+            P = ts / valid
+            Q = p - P
+            d = -0.5 * np.log(1 - 2 * P - Q) - 0.25 * np.log(1 - 2 * Q)
+        else:
+            raise ValueError(f"Expected one of: {', '.join(MODELS)}")
+    d[np.isnan(d) & ~np.isnan(p)] = np.inf
+    return d
+
+
+def distance_matrix(msa, model="p", chunk_rows=1024, chunk_sites=512):
+    """Compute a pairwise distance matrix from an MSA or MultiMSA.
+
+    Returns the headers and an (n, n) float64 matrix.
+    """
+    if model not in MODELS:
+        raise ValueError(f"Expected one of: {', '.join(MODELS)}")
+    headers, codes = encode(msa)
+    n = len(headers)
+    # Identities are counted straight into the output matrix, which is then
+    # converted to distances in place, a few rows at a time to keep the
+    # temporaries small
+    matrix = np.zeros((n, n), dtype=np.float64)
+    valid, same, ts = count_sites(
+        codes,
+        chunk_rows=chunk_rows,
+        chunk_sites=chunk_sites,
+        transitions=model == "k2p",
+        same=matrix,
+    )
+    step = max(1, (1 << 20) // max(n, 1))
+    for start in range(0, n, step):
+        rows = slice(start, start + step)
+        matrix[rows] = distances(
+            valid[rows].astype(np.float64),
+            same[rows],
+            None if ts is None else ts[rows].astype(np.float64),
+            model=model,
+        )
+    np.fill_diagonal(matrix, 0)
+    return headers, matrix
+
+
+def comparable(headers, matrix):
+    """Drop sequences until every remaining pair has comparable sites.
+
+    Sequences with the most incomparable (NaN) pairs are dropped first, e.g.
+    strains that only have a marker no other strain has. Returns the kept
+    headers, their distance matrix, and the dropped headers.
+    """
+    missing = np.isnan(matrix)
+    keep = np.ones(len(headers), dtype=bool)
+    counts = missing.sum(axis=1)
+    while counts.any():
+        worst = int(np.argmax(counts))
+        keep[worst] = False
+        counts -= missing[worst]
+        counts[worst] = 0
+    dropped = [header for header, kept in zip(headers, keep) if not kept]
+    headers = [header for header, kept in zip(headers, keep) if kept]
+    return headers, matrix[np.ix_(keep, keep)], dropped
+
+
+def write_phylip(fp, headers, matrix, precision=6):
+    """Write a square distance matrix in relaxed PHYLIP format, row by row."""
+    fp.write(f"{len(headers)}\n")
+    for header, row in zip(headers, matrix):
+        values = " ".join(f"{value:.{precision}f}" for value in row)
+        fp.write(f"{header} {values}\n")
+
+
+def row_minima(D, r, m, rows):
+    """Smallest (m - 2) D(i, j) - r(j) over j != i, its column, and the
+    largest distance, in each of rows of the active matrix."""
+    block = D[rows, :m]
+    values = (m - 2) * block - r[:m]
+    index = np.arange(len(rows))
+    values[index, rows] = np.inf
+    columns = values.argmin(axis=1)
+    return values[index, columns], columns, block.max(axis=1)
+
+
+def neighbour_joining(headers, matrix, batch=16):
+    """Build an unrooted neighbour-joining tree from a distance matrix.
+
+    The pair minimising Q(i, j) = (m - 2) D(i, j) - r(i) - r(j) is found
+    without computing all of Q. Each row keeps the minimum of
+    (m - 2) D(i, j) - r(j) over the columns present when it was last
+    computed, and that stays a lower bound as taxa are joined: m only
+    shrinks by one per join, so the first term falls by at most the row's
+    largest distance, and every r(j) shrinks by at least the smallest
+    decrease seen in that join. Rows with the lowest bounds are recomputed,
+    a batch at a time, until the lowest bound is an exact row minimum.
+    Every pair is covered by whichever of its rows was computed later, and
+    a joined node's row is computed before it can be chosen, so the result
+    is the same as exact NJ.
+
+    The active matrix is kept contiguous by moving the last row/column into
+    the slot freed by each join, so memory stays O(n^2). Negative branch
+    lengths are set to zero. Saturated (infinite) distances are replaced by
+    the largest finite distance.
+
+    Returns a CompactTree with a trifurcating root.
+    """
+    n = len(headers)
+    if n < 2:
+        raise ValueError("Expected at least two sequences")
+
+    D = np.array(matrix, dtype=np.float64)
+    if np.isnan(D).any():
+        raise ValueError("Distance matrix has pairs without comparable sites")
+    finite = np.isfinite(D)
+    if not finite.all():
+        D[~finite] = D[finite].max()
+
+    nodes = list(range(n))
+    children = {}
+    lengths = {}
+    next_node = n
+    m = n
+
+    r = D.sum(axis=1)
+    # Per row: minimum, its column, largest distance, and m and the total
+    # decrease of r when they were computed
+    rowmin, rowarg, rowmax = row_minima(D, r, m, np.arange(n))
+    size = np.full(n, m)
+    shrunk = np.zeros(n)
+    total = 0.0
+
+    while m > 3:
+        bound = rowmin[:m] - (size[:m] - m) * rowmax[:m] + (total - shrunk[:m]) - r[:m]
+        while True:
+            rows = np.argpartition(bound, min(batch, m) - 1)[:batch]
+            best = bound[rows].min()
+            rows = np.union1d(rows, np.flatnonzero(bound == best))
+            stale = rows[(size[rows] != m) | (shrunk[rows] != total)]
+            if stale.size == 0 or bound[stale].min() > best:
+                break
+            rowmin[stale], rowarg[stale], rowmax[stale] = row_minima(D, r, m, stale)
+            size[stale] = m
+            shrunk[stale] = total
+            bound[stale] = rowmin[stale] - r[stale]
+        # Ties go to the first row, as when scanning all of Q
+        i = int(np.flatnonzero(bound == best)[0])
+        i, j = sorted((i, int(rowarg[i])))
+
+        dij = D[i, j]
+        li = 0.5 * dij + (r[i] - r[j]) / (2 * (m - 2))
+        lj = dij - li
+
+        u = next_node
+        next_node += 1
+        children[u] = [nodes[i], nodes[j]]
+        lengths[nodes[i]] = max(li, 0.0)
+        lengths[nodes[j]] = max(lj, 0.0)
+
+        du = 0.5 * (D[i, :m] + D[j, :m] - dij)
+        du[i] = du[j] = 0.0
+        decrease = D[i, :m] + D[j, :m] - du
+        decrease[i] = decrease[j] = np.inf
+        total += decrease.min()
+        r[:m] += du - D[i, :m] - D[j, :m]
+        r[i] = du.sum()
+        D[i, :m] = du
+        D[:m, i] = du
+        nodes[i] = u
+
+        last = m - 1
+        if j != last:
+            D[j, :m] = D[last, :m]
+            D[:m, j] = D[:m, last]
+            D[j, j] = 0.0
+            r[j] = r[last]
+            nodes[j] = nodes[last]
+            for state in (rowmin, rowarg, rowmax, size, shrunk):
+                state[j] = state[last]
+        m -= 1
+
+        # The joined node has no row minimum yet
+        rowmin[i] = -np.inf
+        size[i] = 0
+
+    root = next_node
+    children[root] = nodes[:m]
+    if m == 3:
+        d01, d02, d12 = D[0, 1], D[0, 2], D[1, 2]
+        for node, value in zip(
+            nodes[:3],
+            (
+                0.5 * (d01 + d02 - d12),
+                0.5 * (d01 + d12 - d02),
+                0.5 * (d02 + d12 - d01),
+            ),
+        ):
+            lengths[node] = max(value, 0.0)
+    else:
+        lengths[nodes[0]] = lengths[nodes[1]] = D[0, 1] / 2
+
+    return CompactTree._build(
+        root,
+        lambda node: children.get(node, []),
+        lambda node: lengths.get(node, float("nan")),
+        lambda node: float("nan"),
+        lambda node: node if node < n else -1,
+        [str(header) for header in headers],
+    )
+
+
+def quick_tree(msa, model="k2p"):
+    """Build a neighbour-joining tree from an MSA, returned in Newick format.
+
+    Sequences without comparable sites to the rest are left out of the tree.
+    """
+    headers, matrix = distance_matrix(msa, model=model)
+    headers, matrix, dropped = comparable(headers, matrix)
+    if dropped:
+        print(f"Leaving out sequences without comparable sites: {', '.join(dropped)}")
+    return neighbour_joining(headers, matrix).write()
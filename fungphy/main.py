@@ -3,8 +3,12 @@ import argparse
 
 from pathlib import Path
 
-from fungphy import plot
 from fungphy import phylogeny as phy
+from fungphy.checkpoint import Checkpoints, digest, digest_msa
+from fungphy import msafile
+from fungphy import query
+from fungphy import timing
+from fungphy import writers
 
 
 def paths_exist(paths):
@@ -37,27 +41,55 @@ def get_parser():
     fasta.add_argument("-fo", "--fasta_out", help="Output FASTA file template")
 
     aligns = parser.add_argument_group("Marker alignment")
-    aligns.add_argument("-mi", "--msa_in", nargs="+", help="Input MSA file/s")
-    aligns.add_argument("-mo", "--msa_out", help="Output MSA file template")
+    aligns.add_argument("-mi", "--msa_in", nargs="+", help="Input MSA file/s, or a binary (.fmsa) alignment")
+    aligns.add_argument("-mo", "--msa_out", help="Output MSA file template (gzipped if ending in .gz, binary if ending in .fmsa)")
+    aligns.add_argument("-mf", "--msa_format", default="fasta", choices=writers.FORMATS, help="Output MSA format")
     aligns.add_argument("-mt", "--msa_tool", default="mafft", choices=["mafft", "muscle"], help="Alignment program")
     aligns.add_argument("-tm", "--trim_msa", action="store_true", help="Trim sequence alignments")
     aligns.add_argument("-pi", "--partition_in", help="Input partition file (RAxML format)")
     aligns.add_argument("-po", "--partition_out", help="Output partition file (RAxML format)")
+    aligns.add_argument("-pm", "--pad_missing", action="store_true", help="Keep strains missing markers, padding them with gaps")
 
     fasttree = parser.add_argument_group("FastTree settings")
     fasttree.add_argument("-ft", "--fasttree", action="store_true", help="Generate a tree using FastTree")
+    fasttree.add_argument("-qt", "--quick_tree", action="store_true", help="Generate a neighbour-joining tree from --distance_model distances")
     fasttree.add_argument("--ft_gtr", action="store_true", help="Use GTR model")
     fasttree.add_argument("--ft_gamma", action="store_true", help="Use gamma model")
+    fasttree.add_argument("--ft_start_trees", help="Directory of previous trees to use as starting topologies")
+    fasttree.add_argument("--ft_full_run", action="store_true", help="Ignore previous trees in --ft_start_trees")
+    fasttree.add_argument("--ft_start_key", help="Name of the strain set for trees in --ft_start_trees (default: from the filters or input files)")
+    fasttree.add_argument("-rs", "--reference_save", nargs="+", help="Store tree as reference tree for a genus or section (e.g. section=Flavi, or genus=Aspergillus section=Flavi if section names are shared)")
+
+    dists = parser.add_argument_group("Distance matrix")
+    dists.add_argument("-do", "--distance_out", help="Output distance matrix file (PHYLIP format)")
+    dists.add_argument("-dm", "--distance_model", default="k2p", choices=["p", "jc69", "k2p"], help="Distance model (default: k2p)")
+
+    infer = parser.add_argument_group("Gene tree inference")
+    infer.add_argument("-gt", "--gene_trees", help="Output tree file template for concatenated and per-marker trees")
+    infer.add_argument("-tp", "--tree_program", default="fasttree", choices=["fasttree", "iqtree"], help="Tree inference program")
+    infer.add_argument("-c", "--cpus", type=int, help="Number of CPUs to share between tree inference runs")
 
     tree = parser.add_argument_group("Tree visualisation")
     tree.add_argument("-ti", "--tree_in", nargs="+", help="Input tree file/s")
     tree.add_argument("-to", "--tree_out", help="Output tree file")
-    tree.add_argument("-ts", "--tree_style", nargs="+", help="ETE3 Treestyle parameters in JSON format")
+    tree.add_argument("-tr", "--tree_render", help="Render tree to file (.pdf, .svg or .png) instead of showing it")
+    tree.add_argument("-ts", "--tree_style", nargs="+", help="ETE3 TreeStyle parameters as key=value pairs")
     tree.add_argument("-tb", "--tree_bold", nargs="+", help="Use bold leaf labels")
     tree.add_argument("-tt", "--tree_type", nargs="+", help="Use type strain numbers")
     tree.add_argument("-tf", "--tree_flip", action="store_true", help="Reverse tree ordering")
     tree.add_argument("-og", "--outgroup", help="Outgroup species")
 
+    checkpoints = parser.add_argument_group("Checkpoints")
+    checkpoints.add_argument("-wd", "--work_dir", help="Directory to store stage checkpoints in, skipping stages whose inputs are unchanged")
+    checkpoints.add_argument("--force", action="store_true", help="Recompute all stages, ignoring checkpoints")
+    checkpoints.add_argument("--invalidate", nargs="+", help="Recompute given stages (align, align:<marker>, tree, gene_trees)")
+
+    profile = parser.add_argument_group("Profiling")
+    profile.add_argument("--profile", action="store_true", help="Print time spent in each stage, external programs and peak memory")
+    profile.add_argument("--profile_trace", help="Write stage timings as a Chrome trace (JSON)")
+    profile.add_argument("--profile_cprofile", help="Write cProfile statistics to file (view with pstats or snakeviz)")
+    profile.add_argument("--profile_sql", action="store_true", help="Print SQL statements run in each stage, repeated (N+1) statements and slow query plans")
+
     table = parser.add_argument_group("Marker accession table")
     table.add_argument("-bi", "--table_in", help="Input table file")
     table.add_argument("-bo", "--table_out", help="Output table file")
@@ -80,29 +112,48 @@ def fungphy(
     fasta_out=None,
     msa_in=None,
     msa_out=None,
+    msa_format="fasta",
     msa_tool="mafft",
     trim_msa=True,
     partition_in=None,
     partition_out=None,
+    pad_missing=False,
     fasttree=False,
+    quick_tree=False,
     ft_gtr=False,
     ft_gamma=False,
+    ft_start_trees=None,
+    ft_full_run=False,
+    ft_start_key=None,
+    reference_save=None,
+    distance_out=None,
+    distance_model="k2p",
+    gene_trees=None,
+    tree_program="fasttree",
+    cpus=None,
     tree_in=None,
     tree_out=None,
+    tree_render=None,
     tree_style=None,
     tree_bold=None,
     tree_type=None,
     tree_flip=False,
     outgroup=None,
+    work_dir=None,
+    force=False,
+    invalidate=None,
     table_in=None,
     table_out=None,
     table_delimiter=",",
     table_headers=False,
 ):
-    strains = None
+    strain_names, strains = strains, None
     table, msa, tree = None, None, None
+    checkpoints = Checkpoints(work_dir, force=force, invalidate=invalidate)
 
     if tree_in:
+        from fungphy import plot
+
         print(f"Loading tree from: {tree_in}")
         if json_filters:
             with open(json_filters) as fp:
@@ -118,13 +169,14 @@ def fungphy(
             bold=tree_bold,
             types=tree_type,
             outgroup=outgroup,
-            merge=True
+            merge=True,
+            flip=tree_flip,
         )
     else:
         if table_in:
             print(f"Loading table from: {table_in}")
             with open(table_file) as fp:
-                table = plot.Summary.from_table(
+                table = query.Summary.from_table(
                     fp,
                     delimiter=table_delimiter,
                     has_headers=table_headers
@@ -137,16 +189,22 @@ def fungphy(
                 names=markers,
                 align=True,
                 tool=msa_tool,
-                trim_msa=trim_msa
+                trim_msa=trim_msa,
+                pad_missing=pad_missing,
             )
 
         elif msa_in:
-            if len(msa_in) == 1 and partition_in:
+            if len(msa_in) == 1 and msafile.is_binary(msa_in[0]):
+                print(f"Loading binary MultiMSA from: {msa_in[0]}")
+                msa = phy.MultiMSA.from_binary(msa_in[0])
+            elif len(msa_in) == 1 and partition_in:
                 print(f"Loading MultiMSA from: {msa_in} and {partition_in}")
                 msa = phy.MultiMSA.from_partitioned(msa_in, partition_in)
             elif len(msa_in) > 1 and markers:
                 print(f"Loading MultiMSA from: {msa_in}")
-                msa = phy.MultiMSA.from_fasta_files(msa_in, names=markers)
+                msa = phy.MultiMSA.from_fasta_files(
+                    msa_in, names=markers, pad_missing=pad_missing
+                )
 
         else:
             if json_filters:
@@ -165,27 +223,32 @@ def fungphy(
                 strains = [
                     strain
                     for group in filters["groups"]
-                    for strain in plot.get_species(markers=markers, **group)
+                    for strain in query.get_species(
+                        markers=markers,
+                        require_all_markers=not pad_missing,
+                        **group,
+                    )
                 ]
             else:
-                if not any([genera, subgenera, sections, species, strains, strain_ids]):
+                if not any([genera, subgenera, sections, species, strain_names, strain_ids]):
                     raise ValueError("No filters have been entered")
 
                 print("Finding strains matching filters")
-                strains = plot.get_species(
+                strains = query.get_species(
                     genera=genera,
                     subgenera=subgenera,
                     sections=sections,
                     species=species,
-                    strains=strains,
+                    strains=strain_names,
                     strain_ids=strain_ids,
                     markers=markers,
+                    require_all_markers=not pad_missing,
                 )
 
             if fasta_out:
                 for marker in markers:
                     name = fasta_out.replace("*", marker)
-                    sequences = plot.get_marker_sequences(strains, marker)
+                    sequences = query.get_marker_sequences(strains, marker)
                     fasta = "\n".join(s.fasta() for s in sequences)
 
                     print(f"Writing unaligned {marker} sequences to: {name}")
@@ -193,35 +256,131 @@ def fungphy(
                         fp.write(fasta)
 
             print(f"Found {len(strains)} strains matching filters")
-            msa = plot.align_strains(strains, markers=markers, trim_msa=trim_msa)
+            msa = query.align_strains(
+                strains,
+                markers=markers,
+                pad_missing=pad_missing,
+                checkpoints=checkpoints,
+                tool=msa_tool,
+                trim_msa=trim_msa,
+            )
+
+            if pad_missing:
+                for name, present, total, fraction in msa.occupancy():
+                    print(f"{name}: {present}/{total} strains ({fraction:.1%})")
 
             if msa_out:
                 if "*" in msa_out:
                     for m in msa:
                         name = msa_out.replace("*", m.name)
                         print(f"Writing aligned {m.name} sequences to: {name}")
-                        with open(name, "w") as fp:
-                            fp.write(m.fasta())
+                        writers.save_alignment(name, m, format=msa_format)
+                elif msa_out.endswith(msafile.EXTENSION):
+                    print(f"Writing binary alignment to: {msa_out}")
+                    msa.save_binary(msa_out)
                 else:
                     print(f"Writing combined alignment to: {msa_out}")
-                    with open(msa_out, "w") as fp:
-                        fp.write(msa.fasta())
+                    writers.save_alignment(msa_out, msa, format=msa_format)
 
         if not strains:
-            strains = plot.get_species(strain_ids=msa.headers)
+            strains = query.get_species(strain_ids=msa.headers)
 
         if not table:
-            table = plot.Summary.from_strains(strains, markers=markers)
+            with timing.span("table"):
+                table = query.Summary.from_strains(strains, markers=markers)
+
+        if distance_out:
+            from fungphy import distance
+
+            print(f"Writing {distance_model} distance matrix to: {distance_out}")
+            with timing.span("distance"):
+                headers, matrix = distance.distance_matrix(msa, model=distance_model)
+                with open(distance_out, "w") as fp:
+                    distance.write_phylip(fp, headers, matrix)
+
+        if ft_start_trees and not ft_start_key:
+            ft_start_key = start_tree_key(
+                genera=genera,
+                subgenera=subgenera,
+                sections=sections,
+                species=species,
+                strains=strain_names,
+                strain_ids=strain_ids,
+                pad_missing=pad_missing,
+                json_filters=json_filters,
+                msa_in=msa_in,
+            )
+
+        if gene_trees:
+            print(f"Inferring concatenated and per-marker trees with {tree_program}")
+            options = {}
+            if tree_program == "fasttree":
+                options = {
+                    "gtr": ft_gtr,
+                    "gamma": ft_gamma,
+                    "start_trees": ft_start_trees,
+                    "full_run": ft_full_run,
+                    "key": ft_start_key,
+                }
+            with timing.span("gene_trees"):
+                trees = checkpoints.data(
+                    "gene_trees",
+                    lambda: digest("gene_trees", digest_msa(msa), tree_program, options),
+                    lambda: {
+                        name: gene_tree.write()
+                        for name, gene_tree in phy.infer_trees(
+                            msa, runner=tree_program, cpus=cpus, **options
+                        ).items()
+                    },
+                )
+            for name, newick in trees.items():
+                path = gene_trees.replace("*", name)
+                print(f"Writing {name} tree to: {path}")
+                with open(path, "w") as fp:
+                    fp.write(newick)
+
+        if (fasttree or quick_tree) and not tree:
+            from fungphy import plot
+
+            def build_tree():
+                if fasttree:
+                    print("Generating tree with FastTree")
+                    return phy.fasttree(
+                        msa,
+                        gtr=ft_gtr,
+                        gamma=ft_gamma,
+                        start_trees=ft_start_trees,
+                        full_run=ft_full_run,
+                        key=ft_start_key,
+                    )
+                from fungphy import distance
+
+                print(f"Generating neighbour-joining tree from {distance_model} distances")
+                return distance.quick_tree(msa, model=distance_model)
+
+            if fasttree:
+                parameters = [
+                    "fasttree", ft_gtr, ft_gamma, ft_start_trees, ft_full_run, ft_start_key
+                ]
+            else:
+                parameters = ["quick_tree", distance_model]
+            with timing.span("tree"):
+                newick = checkpoints.text(
+                    "tree", lambda: digest(digest_msa(msa), *parameters), build_tree
+                )
 
-        if fasttree and not tree:
-            print("Generating tree with FastTree")
             tree = plot.read_tree(
-                phy.fasttree(msa, gtr=ft_gtr, gamma=ft_gamma),
+                newick,
                 bold=tree_bold,
                 types=tree_type,
                 outgroup=outgroup,
+                flip=tree_flip,
             )
 
+            if reference_save:
+                print(f"Storing reference tree for: {reference_save}")
+                query.save_reference_tree(newick, **reference_save)
+
         if partition_out:
             print(f"Writing partitions to: {partition_out}")
             with open(partition_out, "w") as fp:
@@ -239,12 +398,14 @@ def fungphy(
             tree.write(format=0, outfile=tree_out)
 
     if tree:
-        tree.ladderize(1 if tree_flip else 0)
-        if tree_style:
-            ts = plot.get_tree_style(**tree_style)
-            plot.show(tree, ts=ts)
+        from fungphy import plot
+
+        ts = plot.get_tree_style(**tree_style) if tree_style else None
+        if tree_render:
+            print(f"Rendering tree to: {tree_render}")
+            plot.render(tree, tree_render, ts=ts)
         else:
-            plot.show(tree)
+            plot.show(tree, ts=ts)
 
     return table, msa, tree
 
@@ -264,6 +425,42 @@ def handle_file_load_save_args(items):
     return markers, paths
 
 
+def start_tree_key(
+    genera=None,
+    subgenera=None,
+    sections=None,
+    species=None,
+    strains=None,
+    strain_ids=None,
+    pad_missing=False,
+    json_filters=None,
+    msa_in=None,
+):
+    """Name the strain set of a run, to key its trees in --ft_start_trees.
+
+    The key is built from the filters rather than the strains they match, so
+    a rerun after strains have been added starts from the previous trees.
+    Strain number/ID filters, which can be long, are included as a digest.
+    """
+    if json_filters:
+        names = [Path(json_filters).stem]
+    elif msa_in:
+        names = [Path(path).stem for path in msa_in]
+    else:
+        names = [
+            name
+            for names in (genera, subgenera, sections, species)
+            for name in sorted(names or [])
+        ]
+        if strains or strain_ids:
+            names.append(
+                digest(sorted(strains or []), sorted(map(str, strain_ids or [])))[:12]
+            )
+    if pad_missing:
+        names.append("padded")
+    return "-".join(names) or "strains"
+
+
 def handle_nested_kwargs(items):
     args, kwargs = [], {}
     for item in items:
@@ -298,16 +495,68 @@ def validate_args(args):
         set_markers(args, markers, source="msa")
         setattr(args, "msa_in", paths)
 
+    if args.reference_save:
+        _, reference_kwargs = handle_nested_kwargs(args.reference_save)
+        setattr(args, "reference_save", reference_kwargs)
+
     if args.tree_style:
-        _, ts_kwargs = handle_nested_kwargs(args.tree_style)
-        setattr(args, "tree_style", ts_kwargs)
+        from fungphy.plot import handle_tree_style_kwargs
+
+        setattr(args, "tree_style", handle_tree_style_kwargs(args.tree_style))
+
+
+def profile_run(
+    options,
+    profile=False,
+    profile_trace=None,
+    profile_cprofile=None,
+    profile_sql=False,
+):
+    """Run fungphy() with stage timing and, optionally, cProfile enabled."""
+    if not (profile or profile_trace or profile_cprofile or profile_sql):
+        return fungphy(**options)
+
+    timing.enable()
+    queries = None
+    if profile_sql:
+        from fungphy import sqlstats
+
+        queries = sqlstats.Scope().start()
+    profiler = None
+    if profile_cprofile:
+        import cProfile
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        return fungphy(**options)
+    finally:
+        if profiler:
+            profiler.disable()
+            print(f"Writing cProfile statistics to: {profile_cprofile}")
+            profiler.dump_stats(profile_cprofile)
+        if profile_trace:
+            print(f"Writing timing trace to: {profile_trace}")
+            timing.write_trace(profile_trace)
+        if profile:
+            print(timing.report())
+        if queries:
+            print(queries.stop().report())
+        timing.disable()
 
 
 def main():
     parser = get_parser()
     args = parser.parse_args()
     validate_args(args)
-    fungphy(**vars(args))
+    options = vars(args)
+    profile_run(
+        options,
+        profile=options.pop("profile"),
+        profile_trace=options.pop("profile_trace"),
+        profile_cprofile=options.pop("profile_cprofile"),
+        profile_sql=options.pop("profile_sql"),
+    )
 
 
 if __name__ == "__main__":
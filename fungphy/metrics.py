@@ -0,0 +1,295 @@
+"""In-process metrics for the web app, exposed in Prometheus text format.
+
+Metrics are collected without any external service:
+
+- request latency and in-flight requests from Flask request hooks
+- SQL query counts and time per request from fungphy.sqlstats
+- alignments in flight and external program runtimes from timing spans
+- cache hits and misses reported by cached lookups via cache_hit()/cache_miss()
+
+init_app() installs the hooks on a Flask app and serves the current values at
+/metrics, ready to be scraped.
+"""
+
+import threading
+import time
+
+from bisect import bisect_left
+
+from fungphy import sqlstats, timing
+from fungphy.database import engine
+
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+TOOL_BUCKETS = (0.1, 0.5, 1, 5, 10, 30, 60, 120, 300, 600, 1800)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{escape(value)}"' for name, value in pairs) + "}"
+
+
+def format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class Metric:
+    """Base class of metrics with optional labels, safe to update from any thread."""
+
+    kind = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.values = {}
+        self.lock = threading.Lock()
+        registry.append(self)
+
+    def key(self, labels):
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def samples(self):
+        """Yield (suffix, label values, extra labels, value) tuples."""
+        with self.lock:
+            items = sorted(self.values.items())
+        for key, value in items:
+            yield "", key, (), value
+
+    def expose(self):
+        lines = [
+            f"# HELP {self.name} {escape(self.documentation)}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        for suffix, key, extra, value in self.samples():
+            labels = format_labels(self.labels, key, extra)
+            lines.append(f"{self.name}{suffix}{labels} {format_value(value)}")
+        return "\n".join(lines)
+
+    def clear(self):
+        with self.lock:
+            self.values.clear()
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels):
+        return self.values.get(self.key(labels), 0)
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[self.key(labels)] = value
+
+    def get(self, **labels):
+        return self.values.get(self.key(labels), 0)
+
+
+class Histogram(Metric):
+    """Cumulative histogram; values are [bucket counts..., sum, count]."""
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            state = self.values.get(key)
+            if state is None:
+                state = self.values[key] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                state[index] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def samples(self):
+        with self.lock:
+            items = sorted((key, list(state)) for key, state in self.values.items())
+        for key, state in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, state):
+                cumulative += count
+                yield "_bucket", key, [("le", format_value(float(bound)))], cumulative
+            yield "_bucket", key, [("le", "+Inf")], state[-1]
+            yield "_sum", key, (), state[-2]
+            yield "_count", key, (), state[-1]
+
+
+registry = []
+
+http_requests = Histogram(
+    "fungphy_http_request_duration_seconds",
+    "Time taken to handle HTTP requests.",
+    labels=("route", "method", "status"),
+)
+http_in_flight = Gauge(
+    "fungphy_http_requests_in_flight",
+    "HTTP requests currently being handled.",
+)
+alignments_in_flight = Gauge(
+    "fungphy_alignments_in_flight",
+    "Marker alignments currently running.",
+)
+tool_seconds = Histogram(
+    "fungphy_external_tool_seconds",
+    "Wall time of external programs (aligners, tree builders).",
+    labels=("tool",),
+    buckets=TOOL_BUCKETS,
+)
+cache_requests = Counter(
+    "fungphy_cache_requests_total",
+    "Lookups in in-process caches, by result (hit or miss).",
+    labels=("cache", "result"),
+)
+cache_ratio = Gauge(
+    "fungphy_cache_hit_ratio",
+    "Fraction of cache lookups that were hits.",
+    labels=("cache",),
+)
+sql_queries = Counter(
+    "fungphy_sql_queries_total",
+    "SQL statements executed.",
+)
+sql_seconds = Counter(
+    "fungphy_sql_seconds_total",
+    "Time spent executing SQL statements.",
+)
+request_queries = Histogram(
+    "fungphy_http_request_sql_queries",
+    "SQL statements executed per HTTP request.",
+    labels=("route",),
+    buckets=QUERY_BUCKETS,
+)
+request_sql_seconds = Histogram(
+    "fungphy_http_request_sql_seconds",
+    "Time spent executing SQL statements per HTTP request.",
+    labels=("route",),
+)
+
+
+def exposition():
+    """Return all metrics in the Prometheus text exposition format."""
+    return "\n".join(metric.expose() for metric in registry) + "\n"
+
+
+def reset():
+    """Clear all recorded values."""
+    for metric in registry:
+        metric.clear()
+
+
+def _cache_lookup(name, result):
+    cache_requests.inc(cache=name, result=result)
+    hits = cache_requests.get(cache=name, result="hit")
+    misses = cache_requests.get(cache=name, result="miss")
+    cache_ratio.set(hits / (hits + misses), cache=name)
+
+
+def cache_hit(name):
+    _cache_lookup(name, "hit")
+
+
+def cache_miss(name):
+    _cache_lookup(name, "miss")
+
+
+class SpanListener:
+    """Feed alignment and external program metrics from timing spans."""
+
+    def span_started(self, span):
+        if span.name == "align":
+            alignments_in_flight.inc()
+
+    def span_finished(self, span):
+        if span.name == "align":
+            alignments_in_flight.dec()
+        if span.program:
+            tool_seconds.observe(span.wall, tool=span.name)
+
+
+def record_query(statement, seconds):
+    sql_queries.inc()
+    sql_seconds.inc(seconds)
+
+
+span_listener = SpanListener()
+
+
+def instrument(bind=engine):
+    """Start collecting SQL and span metrics."""
+    sqlstats.install(bind)
+    sqlstats.add_observer(record_query)
+    timing.add_listener(span_listener)
+
+
+def init_app(app, bind=engine):
+    """Collect metrics for requests handled by app, and serve them at /metrics."""
+    from flask import Response, g, request
+
+    instrument(bind)
+
+    @app.before_request
+    def start_request_metrics():
+        g.metrics_start = time.perf_counter()
+        http_in_flight.inc()
+        g.metrics_sql = sqlstats.Scope(repeat=None, slow=None).start()
+
+    @app.after_request
+    def record_status(response):
+        g.metrics_status = response.status_code
+        return response
+
+    @app.teardown_request
+    def finish_request_metrics(exception=None):
+        if "metrics_start" not in g:
+            return
+        elapsed = time.perf_counter() - g.pop("metrics_start")
+        http_in_flight.dec()
+        route = request.url_rule.rule if request.url_rule else "<unmatched>"
+        http_requests.observe(
+            elapsed,
+            route=route,
+            method=request.method,
+            status=g.pop("metrics_status", 500),
+        )
+        scope = g.pop("metrics_sql").stop()
+        request_queries.observe(scope.count, route=route)
+        request_sql_seconds.observe(scope.seconds, route=route)
+
+    def metrics():
+        return Response(exposition(), content_type=CONTENT_TYPE)
+
+    app.add_url_rule("/metrics", "metrics", metrics)
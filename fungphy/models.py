@@ -1,15 +1,24 @@
+import hashlib
+
 from sqlalchemy import (
     Column,
+    DateTime,
     Integer,
+    LargeBinary,
     String,
+    Text,
     Boolean,
     ForeignKey,
     UniqueConstraint
 )
+from sqlalchemy import event, exists, inspect, select
 from sqlalchemy.sql import text
-from sqlalchemy.orm import relationship, backref
+from sqlalchemy.orm import Session, backref, object_session, relationship
+from sqlalchemy.orm.base import NO_VALUE
+from sqlalchemy.orm.util import identity_key
 from sqlalchemy.ext.hybrid import hybrid_property
-from fungphy.database import Base
+from fungphy.compression import PackedSequence, decode, encode
+from fungphy.database import Base, session
 
 
 class Genus(Base):
@@ -176,6 +185,80 @@ class MarkerType(Base):
         return self.name
 
 
+class MarkerSequence(Base):
+    """A unique marker sequence, keyed by a hash of its content.
+
+    Markers with byte-identical sequences share one row. Hashes are 16 byte
+    BLAKE2b digests, kept binary since they are stored in every Marker row.
+    """
+
+    __tablename__ = "marker_sequence"
+
+    hash = Column(LargeBinary, primary_key=True)
+    packed_sequence = Column("sequence", PackedSequence)
+
+    # Not loaded with Markers by default; see query.undefer_sequences
+    markers = relationship("Marker", backref="stored_sequence")
+
+    @property
+    def sequence(self):
+        """The sequence, decoded from packed_sequence on first access."""
+        packed = self.packed_sequence
+        cached = self.__dict__.get("_decoded")
+        if cached is None or cached[0] is not packed:
+            cached = self.__dict__["_decoded"] = (packed, decode(packed))
+        return cached[1]
+
+    @staticmethod
+    def digest(sequence):
+        return hashlib.blake2b(sequence.encode(), digest_size=16).digest()
+
+    @classmethod
+    def get(cls, sequence, session=session):
+        """Return the MarkerSequence of a sequence, creating it if new.
+
+        New instances are added to the session along with the Markers they
+        are assigned to; until they are flushed, they are remembered in
+        session.info so that repeated sequences are not added twice.
+        """
+        key = cls.digest(sequence)
+        pending = session.info.setdefault("marker_sequences", {})
+        instance = pending.get(key) or session.query(cls).get(key)
+        if instance is None:
+            instance = pending[key] = cls(hash=key, packed_sequence=encode(sequence))
+        return instance
+
+    @classmethod
+    def delete_orphans(cls, session=session, hashes=None):
+        """Delete MarkerSequences that no Marker refers to.
+
+        Only the given hashes are checked, if any; otherwise the whole table
+        is swept. Returns the number of rows deleted.
+        """
+        orphaned = select([cls.hash]).where(
+            ~exists().where(Marker.sequence_hash == cls.hash)
+        )
+        if hashes is None:
+            found = [row[0] for row in session.execute(orphaned)]
+        else:
+            hashes = [key for key in hashes if key is not None]
+            found = []
+            for start in range(0, len(hashes), 500):
+                chunk = hashes[start : start + 500]
+                found.extend(
+                    row[0] for row in session.execute(orphaned.where(cls.hash.in_(chunk)))
+                )
+
+        for start in range(0, len(found), 500):
+            chunk = found[start : start + 500]
+            session.execute(cls.__table__.delete().where(cls.hash.in_(chunk)))
+        for key in found:
+            instance = session.identity_map.get(identity_key(cls, key))
+            if instance is not None:
+                session.expunge(instance)
+        return len(found)
+
+
 class Marker(Base):
     """A phylogenetic marker."""
 
@@ -183,8 +266,8 @@ class Marker(Base):
 
     id = Column(Integer, primary_key=True, nullable=True)
     accession = Column(String, unique=True)
-    sequence = Column(String)
 
+    sequence_hash = Column(LargeBinary, ForeignKey("marker_sequence.hash"))
     marker_type_id = Column(Integer, ForeignKey("marker_type.id", ondelete="CASCADE"))
     strain_id = Column(Integer, ForeignKey("strain.id", ondelete="CASCADE")) 
 
@@ -197,6 +280,80 @@ class Marker(Base):
     def fasta(self):
         return f">{self.strain_id}\n{self.sequence}"
 
+    @property
+    def sequence(self):
+        """The sequence, loaded from stored_sequence on first access."""
+        stored = self.stored_sequence
+        return stored.sequence if stored else None
+
+    @sequence.setter
+    def sequence(self, value):
+        if value is None:
+            self.stored_sequence = None
+        else:
+            self.stored_sequence = MarkerSequence.get(
+                value, object_session(self) or session
+            )
+
     @property
     def marker(self):
         return self.marker_type.name
+
+
+class ReferenceTree(Base):
+    """A stored reference tree for a genus or section.
+
+    Leaves are named by Strain.id, so trees for any subset of strains can be
+    obtained by pruning instead of re-running alignment and inference.
+    """
+
+    __tablename__ = "reference_tree"
+
+    id = Column(Integer, primary_key=True)
+    newick = Column(Text)
+    description = Column(String)
+    created = Column(DateTime, server_default=text("CURRENT_TIMESTAMP"))
+
+    genus_id = Column(Integer, ForeignKey("genus.id", ondelete="CASCADE"))
+    section_id = Column(Integer, ForeignKey("section.id", ondelete="CASCADE"))
+
+    genus = relationship("Genus", backref=backref("reference_trees", passive_deletes=True))
+    section = relationship("Section", backref=backref("reference_trees", passive_deletes=True))
+
+    def __str__(self):
+        return f"{self.section or self.genus} reference tree"
+
+
+@event.listens_for(Session, "before_flush")
+def collect_replaced_sequences(session, context, instances):
+    """Note the sequences of Markers being deleted or given a new sequence."""
+    replaced = session.info.setdefault("replaced_sequences", set())
+    for marker in list(session.deleted) + list(session.dirty):
+        if isinstance(marker, Marker):
+            # The column keeps the stored hash until the flush updates it
+            key = inspect(marker).attrs.sequence_hash.loaded_value
+            if key is NO_VALUE and marker in session.deleted:
+                key = marker.sequence_hash
+            if isinstance(key, bytes):
+                replaced.add(key)
+
+
+@event.listens_for(Session, "after_flush_postexec")
+def delete_replaced_sequences(session, context):
+    """Delete sequences left without Markers, and forget flushed new ones."""
+    replaced = session.info.pop("replaced_sequences", None)
+    if replaced:
+        MarkerSequence.delete_orphans(session, replaced)
+    pending = session.info.get("marker_sequences")
+    if pending:
+        session.info["marker_sequences"] = {
+            key: instance
+            for key, instance in pending.items()
+            if inspect(instance).transient
+        }
+
+
+@event.listens_for(Session, "after_rollback")
+def forget_pending_sequences(session):
+    session.info.pop("marker_sequences", None)
+    session.info.pop("replaced_sequences", None)
@@ -0,0 +1,157 @@
+"""Binary alignment container, read back via numpy.memmap.
+
+Layout:
+    8 bytes   magic, b"FUNGMSA1"
+    8 bytes   little-endian uint64, length of the JSON metadata
+    n bytes   JSON metadata: headers, shape and partitions
+              ([name, start, end] with 0-based, end-exclusive columns, plus
+              the row indices missing from each partition)
+    padding   to a 64 byte boundary
+    matrix    rows x columns uint8 ASCII characters, row-major
+
+Loading reads only the metadata; the matrix is memory-mapped read-only, so
+opening a large supermatrix is near-instant, partitions are column views of
+one map, and worker processes opening the same file share its pages.
+"""
+
+import json
+import struct
+
+import numpy as np
+
+import fungphy.phylogeny as phy
+
+
+MAGIC = b"FUNGMSA1"
+EXTENSION = ".fmsa"
+ALIGNMENT = 64
+
+
+class ArraySequence(phy.Sequence):
+    """A Sequence whose characters are a row of a uint8 matrix.
+
+    The row is decoded to a string only when .sequence is accessed.
+    """
+
+    def __init__(self, header, row):
+        self.header = header
+        self.row = row
+
+    @property
+    def sequence(self):
+        return self.row.tobytes().decode("ascii")
+
+    def __len__(self):
+        return len(self.row)
+
+
+def is_binary(path):
+    """Check if a file is a binary alignment container."""
+    try:
+        with open(path, "rb") as fp:
+            return fp.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
+
+
+def save(path, msa):
+    """Write an MSA or MultiMSA to a binary alignment container.
+
+    Headers missing from partitions of a padded MultiMSA are stored as gaps
+    and recorded, so the MultiMSA loads with the same occupancy.
+    """
+    msas = list(msa) if isinstance(msa, phy.MultiMSA) else [msa]
+    headers = list(msa.headers)
+    rows = {header: i for i, header in enumerate(headers)}
+
+    partitions, start = [], 0
+    for m in msas:
+        present = set(m.headers)
+        missing = [i for i, header in enumerate(headers) if header not in present]
+        partitions.append([m.name, start, start + len(m), missing])
+        start += len(m)
+    shape = (len(headers), start)
+
+    metadata = {"headers": headers, "shape": shape, "partitions": partitions}
+    encoded = json.dumps(metadata).encode()
+    offset = matrix_offset(len(encoded))
+
+    with open(path, "wb") as fp:
+        fp.write(MAGIC)
+        fp.write(struct.pack("<Q", len(encoded)))
+        fp.write(encoded)
+        fp.write(b"\0" * (offset - fp.tell()))
+
+    if not all(shape):
+        return
+    matrix = np.memmap(path, dtype=np.uint8, mode="r+", offset=offset, shape=shape)
+    for m, (_, start, stop, missing) in zip(msas, partitions):
+        block = matrix[:, start:stop]
+        if missing:
+            block[missing] = ord("-")
+        for record in m:
+            row = getattr(record, "row", None)
+            if row is None:
+                row = np.frombuffer(record.sequence.encode("ascii"), dtype=np.uint8)
+            block[rows[record.header]] = row
+    matrix.flush()
+    del matrix
+
+
+def matrix_offset(size):
+    """Offset of the matrix after metadata of a given size, 64-byte aligned."""
+    offset = len(MAGIC) + 8 + size
+    return offset + -offset % ALIGNMENT
+
+
+def read_metadata(path):
+    """Read the metadata of a binary alignment, adding the matrix offset."""
+    with open(path, "rb") as fp:
+        if fp.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"Not a binary alignment file: {path}")
+        (size,) = struct.unpack("<Q", fp.read(8))
+        metadata = json.loads(fp.read(size))
+    metadata["offset"] = matrix_offset(size)
+    return metadata
+
+
+def load(path):
+    """Open a binary alignment container as a MultiMSA backed by a memmap.
+
+    The MultiMSA (and each MSA without missing rows) gets a .matrix
+    attribute holding its uint8 view of the map.
+    """
+    metadata = read_metadata(path)
+    headers = metadata["headers"]
+    shape = tuple(metadata["shape"])
+    if all(shape):
+        matrix = np.memmap(
+            path, dtype=np.uint8, mode="r", offset=metadata["offset"], shape=shape
+        )
+    else:
+        matrix = np.zeros(shape, dtype=np.uint8)
+
+    msas, padded = [], False
+    for name, start, stop, missing in metadata["partitions"]:
+        block = matrix[:, start:stop]
+        skip = set(missing)
+        msa = phy.MSA(
+            name=name,
+            records=[
+                ArraySequence(header, block[i])
+                for i, header in enumerate(headers)
+                if i not in skip
+            ],
+        )
+        if skip:
+            padded = True
+        else:
+            msa.matrix = block
+        msas.append(msa)
+
+    mmsa = phy.MultiMSA(msas, pad_missing=padded)
+    if padded:
+        # Keep the stored row order, which matrix rows follow
+        mmsa._headers = list(headers)
+    mmsa.matrix = matrix
+    return mmsa
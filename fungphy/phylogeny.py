@@ -3,12 +3,18 @@
 from __future__ import annotations
 
 import datetime
+import os
 import re
 import subprocess
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from tempfile import NamedTemporaryFile as NTF
+from tempfile import NamedTemporaryFile as NTF, TemporaryDirectory
 from typing import TextIO, List
 
+from fungphy import timing
+from fungphy.compact import CompactTree
+
 
 def parse_alignment(handle: TextIO) -> List[Sequence]:
     header, body = "", ""
@@ -29,6 +35,7 @@ def parse_alignment(handle: TextIO) -> List[Sequence]:
     return records
 
 
+@timing.span("trim")
 def trim(msa, threshold=0.0):
     """Trim a MSA to its first and last non-gap containing columns."""
 
@@ -62,12 +69,17 @@ class MultiMSA:
 
     Keep MSA objects separate and dynamically generate partition information.
 
-    Headers in each MSA must be identical.
+    Headers in each MSA must be identical, unless pad_missing is True; then
+    headers are the union of all MSAs, and a header missing from an MSA is
+    given a block of gaps the length of that MSA. Empty MSAs would be empty
+    partitions, so they are rejected; callers should skip them.
     """
 
-    def __init__(self, msas=None):
+    def __init__(self, msas=None, pad_missing=False):
         self.msas = []
         self.partitions = []
+        self.pad_missing = pad_missing
+        self._headers = []
         if msas:
             for msa in msas:
                 self.add(msa)
@@ -77,7 +89,9 @@ class MultiMSA:
 
     def __getitem__(self, value):
         if isinstance(value, slice):
-            return MultiMSA(self.msas[value.start : value.stop])
+            return MultiMSA(
+                self.msas[value.start : value.stop], pad_missing=self.pad_missing
+            )
         else:
             return self.msas[value]
 
@@ -86,6 +100,8 @@ class MultiMSA:
 
     @property
     def headers(self):
+        if self.pad_missing:
+            return list(self._headers)
         return self.msas[0].headers
 
     def compute_partitions(self):
@@ -97,9 +113,9 @@ class MultiMSA:
             self.partitions.append(position)
 
     def __add__(self, other):
-        if self.msas and not self.headers_match(other):
+        if self.msas and not self.pad_missing and not self.headers_match(other):
             raise ValueError("Headers do not match")
-        return MultiMSA(self.msas + other.msas)
+        return MultiMSA(self.msas + other.msas, pad_missing=self.pad_missing)
 
     def headers_match(self, other):
         if not isinstance(other, MultiMSA):
@@ -109,12 +125,43 @@ class MultiMSA:
     def add(self, new):
         if not isinstance(new, MSA):
             raise ValueError("Expected MSA object")
-        for msa in self:
-            if set(msa.headers) != set(new.headers):
-                raise ValueError(f"Header mismatch: {msa.name} vs {new.name}")
+        if not len(new):
+            raise ValueError(f"Empty alignment: {new.name}")
+        if self.pad_missing:
+            seen = set(self._headers)
+            self._headers.extend(h for h in new.headers if h not in seen)
+        else:
+            for msa in self:
+                if set(msa.headers) != set(new.headers):
+                    raise ValueError(f"Header mismatch: {msa.name} vs {new.name}")
         self.msas.append(new)
         self.compute_partitions()
 
+    def iter_rows(self):
+        """Yield (header, concatenated sequence) for every header.
+
+        Each MSA's records are indexed once, and headers missing from an MSA
+        share a single gap block built per MSA.
+        """
+        records = [{r.header: r.sequence for r in msa} for msa in self]
+        gaps = ["-" * len(msa) for msa in self]
+        for header in self.headers:
+            yield header, "".join(
+                record.get(header, gap) for record, gap in zip(records, gaps)
+            )
+
+    def occupancy(self):
+        """Report the number and fraction of headers present per partition.
+
+        Returns a list of (name, present, total, fraction) tuples.
+        """
+        total = len(self.headers)
+        stats = []
+        for msa in self:
+            present = msa.count()
+            stats.append((msa.name, present, total, present / total if total else 0.0))
+        return stats
+
     def iter_partitions(self):
         for msa_name, (start, end) in zip(self, self.partitions):
             yield msa_name, (start, end)
@@ -127,13 +174,12 @@ class MultiMSA:
 
     def fasta(self):
         return "\n".join(
-            f">{header}\n{''.join(msa[header].sequence for msa in self)}"
-            for header in self.headers
+            f">{header}\n{sequence}" for header, sequence in self.iter_rows()
         )
 
     @classmethod
     def from_fasta_files(cls, files, names=None, tool="mafft", trim_msa=True,
-                         align=False):
+                         align=False, pad_missing=False):
         if names and len(files) != len(names):
             raise ValueError("File list different size than name list")
         msas, size = [], len(files)
@@ -147,7 +193,7 @@ class MultiMSA:
             else:
                 m = MSA.from_file_path(fasta, name=name)
             msas.append(m)
-        return cls(msas)
+        return cls(msas, pad_missing=pad_missing)
 
     @classmethod
     def from_partitioned(cls, msa_file, partition_file):
@@ -168,6 +214,18 @@ class MultiMSA:
                 msas.append(m)
         return cls(msas)
 
+    @classmethod
+    def from_binary(cls, path):
+        """Open a binary alignment (see fungphy.msafile), memory-mapped."""
+        from fungphy import msafile
+
+        return msafile.load(path)
+
+    def save_binary(self, path):
+        from fungphy import msafile
+
+        msafile.save(path, self)
+
 
 class MSA:
     """Represents a multiple sequence alignment."""
@@ -180,6 +238,8 @@ class MSA:
         return iter(self.records)
 
     def __len__(self):
+        if not self.records:
+            return 0
         return len(self.records[0].sequence)
 
     def __getitem__(self, value):
@@ -227,6 +287,21 @@ class MSA:
             msa = cls.from_file(fp, name=name)
         return msa
 
+    @classmethod
+    def from_binary(cls, path):
+        """Open a single partition binary alignment, memory-mapped."""
+        from fungphy import msafile
+
+        mmsa = msafile.load(path)
+        if len(mmsa.msas) != 1:
+            raise ValueError(f"Expected one partition, found {len(mmsa.msas)}")
+        return mmsa[0]
+
+    def save_binary(self, path):
+        from fungphy import msafile
+
+        msafile.save(path, self)
+
 
 class Sequence:
     """Represents a sequence in a FASTA file."""
@@ -253,14 +328,51 @@ class Sequence:
             return parse_alignment(fp)[0]
 
 
+def collapse(sequences):
+    """Collapse identical sequences.
+
+    Returns a list of unique Sequence objects, headed by their index, and the
+    index of the unique sequence for each input sequence.
+    """
+    unique, indices = {}, []
+    for sequence in sequences:
+        indices.append(unique.setdefault(sequence.sequence, len(unique)))
+    collapsed = [Sequence(str(i), sequence) for sequence, i in unique.items()]
+    return collapsed, indices
+
+
+def expand(msa, sequences, indices):
+    """Expand an alignment of collapse() output back to the original sequences."""
+    rows = {record.header: record.sequence for record in msa}
+    return MSA(
+        name=msa.name,
+        records=[
+            Sequence(sequence.header, rows[str(i)])
+            for sequence, i in zip(sequences, indices)
+        ],
+    )
+
+
+@timing.span("align")
 def align_sequences(sequences, name=None, tool="mafft", cpu=2, trim_msa=False):
-    """Align Sequence objects."""
+    """Align Sequence objects.
+
+    Identical sequences are aligned once, then copied to each of their headers.
+    """
+    sequences = list(sequences)
+    collapsed, indices = collapse(sequences)
 
-    with NTF("w") as fna:
-        fasta = "\n".join(s.fasta() for s in sequences)
-        fna.write(fasta)
-        fna.seek(0)
-        msa = align(fna.name, tool=tool, name=name, cpu=cpu)
+    if len(collapsed) == 1:
+        # Nothing to align, and MAFFT refuses a single sequence
+        msa = MSA(name=name, records=collapsed)
+    else:
+        with NTF("w") as fna:
+            fasta = "\n".join(s.fasta() for s in collapsed)
+            fna.write(fasta)
+            fna.seek(0)
+            msa = align(fna.name, tool=tool, name=name, cpu=cpu)
+
+    msa = expand(msa, sequences, indices)
 
     if trim_msa:
         msa = trim(msa)
@@ -278,32 +390,282 @@ def align(fasta, tool="mafft", name=None, cpu=2):
         cmd = ["muscle", "-in", fasta, "-quiet"]
     else:
         raise ValueError("Expected 'mafft' or 'muscle'")
-    process = subprocess.run(cmd, stdout=subprocess.PIPE)
+    process = timing.run(cmd, stdout=subprocess.PIPE)
     return MSA.from_file(process.stdout.decode().split("\n"), name=name)
 
 
-def iqtree(msa):
-    """Generate tree from MSA using IQ-Tree."""
-    # TODO: "-B", "1000", "--alrt", "1000",
-    cmd = ["iqtree", "-s", msa, "-nt", "AUTO", "--quiet"]
-    tree = subprocess.run(cmd, stdout=subprocess.PIPE)
-    return tree.stdout.decode()
-
+def format_flags(options):
+    """Convert keyword arguments to command line flags.
 
-def fasttree(msa, **kwargs):
-    """Run FastTree on an MSA."""
-
-    cmd = ["FastTree", "-quiet", "-nt"]
-
-    for key, value in kwargs.items():
-        # Check if argument is a boolean flag
+    Booleans are treated as flags, e.g. gtr=True => -gtr; other values are
+    passed as -key value.
+    """
+    flags = []
+    for key, value in options.items():
         if value is True:
-            cmd.append(f"-{key}")
-        elif value is False:
+            flags.append(f"-{key}")
+        elif value is False or value is None:
             pass
         else:
-            cmd.extend([f"-{key}", value])
+            flags.extend([f"-{key}", str(value)])
+    return flags
+
+
+class TreeRunner(ABC):
+    """Base class for tree inference programs.
+
+    Subclasses implement run(), which takes an MSA or MultiMSA, a thread
+    count and an optional run name (e.g. marker), and returns a Newick
+    string. Keyword arguments given on creation are passed to the program
+    as flags.
+    """
+
+    executable = None
+
+    def __init__(self, executable=None, **options):
+        if executable:
+            self.executable = executable
+        self.options = options
+
+    @abstractmethod
+    def run(self, msa, threads=1, name=None):
+        """Run the program on msa and return the tree in Newick format."""
+
+    def check(self, process):
+        if process.returncode != 0:
+            raise RuntimeError(
+                f"{self.executable} failed [code {process.returncode}]: {process.stderr}"
+            )
+
+
+def sequence_map(msa):
+    """Map headers to (concatenated) aligned sequences of an MSA or MultiMSA."""
+    if isinstance(msa, MultiMSA):
+        return dict(msa.iter_rows())
+    return {record.header: record.sequence for record in msa}
+
 
-    process = subprocess.run(cmd, text=True, input=msa.fasta(), capture_output=True)
+def base_masks(sequence):
+    """Encode a sequence as one integer bitmask of positions per nucleotide."""
+    masks = []
+    upper = sequence.upper()
+    for base in "ACGT":
+        bits = "".join("1" if c == base else "0" for c in upper)
+        masks.append(int(bits, 2) if bits else 0)
+    return masks
 
-    return process.stdout.strip()
+
+def nearest_neighbours(sequences, queries, references):
+    """Find the closest reference sequence to each query by p-distance.
+
+    Positions that are gaps or ambiguous in either sequence are ignored.
+    Sequences are compared as per-nucleotide bitmasks, so each comparison
+    is a handful of integer operations regardless of alignment length.
+    """
+    masks = {header: base_masks(sequences[header]) for header in references}
+    nearest = {}
+    for query in queries:
+        qa, qc, qg, qt = base_masks(sequences[query])
+        qvalid = qa | qc | qg | qt
+        best, best_distance = None, None
+        for header in references:
+            ra, rc, rg, rt = masks[header]
+            valid = bin(qvalid & (ra | rc | rg | rt)).count("1")
+            if not valid:
+                continue
+            same = bin((qa & ra) | (qc & rc) | (qg & rg) | (qt & rt)).count("1")
+            distance = 1 - same / valid
+            if best_distance is None or distance < best_distance:
+                best, best_distance = header, distance
+        if best is not None:
+            nearest[query] = best
+    return nearest
+
+
+def prepare_start_tree(previous, msa):
+    """Adapt a previous tree to the headers of an MSA for use as a start tree.
+
+    Leaves no longer in the MSA are pruned, and new headers are grafted next
+    to their nearest neighbour in the previous tree. Returns None if too few
+    leaves are shared for the previous tree to be useful.
+    """
+    headers = set(msa.headers)
+    leaves = set(previous.get_leaf_names())
+    shared = headers & leaves
+    if len(shared) < 3:
+        return None
+
+    tree = previous.prune(shared) if leaves - shared else previous
+
+    added = [header for header in msa.headers if header not in leaves]
+    if added:
+        sequences = sequence_map(msa)
+        nearest = nearest_neighbours(sequences, added, sorted(shared))
+        if len(nearest) != len(added):
+            return None
+        placements = {}
+        for query, neighbour in nearest.items():
+            placements.setdefault(neighbour, []).append(query)
+        tree = tree.graft(placements)
+
+    return tree
+
+
+class FastTree(TreeRunner):
+    """FastTree; threads are used by FastTreeMP builds via OMP_NUM_THREADS.
+
+    If `start_trees` is a directory, the tree for each named run is saved
+    there, and the next run with that name starts from it (-intree) after
+    pruning removed and grafting new leaves. `key` names the strain set the
+    trees belong to (e.g. a section), so runs on different strain sets do
+    not share trees. `full_run` ignores saved trees, but still saves the
+    new one.
+    """
+
+    executable = "FastTree"
+
+    def __init__(
+        self, executable=None, start_trees=None, full_run=False, key=None, **options
+    ):
+        super().__init__(executable=executable, **options)
+        self.start_trees = Path(start_trees) if start_trees else None
+        self.full_run = full_run
+        self.key = key
+
+    def start_tree_path(self, name):
+        if not (self.start_trees and name):
+            return None
+        if self.key:
+            name = f"{self.key}_{name}"
+        name = re.sub(r"[^\w.-]+", "_", name)
+        return self.start_trees / f"{name}.nw"
+
+    def run(self, msa, threads=1, name=None):
+        cmd = [self.executable, "-quiet", "-nt", *format_flags(self.options)]
+        env = dict(os.environ, OMP_NUM_THREADS=str(threads))
+        path = self.start_tree_path(name)
+
+        with TemporaryDirectory() as folder:
+            if path and path.exists() and not self.full_run:
+                start = prepare_start_tree(CompactTree.from_newick_file(path), msa)
+                if start:
+                    intree = Path(folder) / "start.nw"
+                    intree.write_text(start.write())
+                    cmd.extend(["-intree", str(intree)])
+            process = timing.run(
+                cmd, text=True, input=msa.fasta(), capture_output=True, env=env
+            )
+
+        self.check(process)
+        newick = process.stdout.strip()
+
+        if path:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(newick)
+
+        return newick
+
+
+class IQTree(TreeRunner):
+    """IQ-TREE; a MultiMSA is run with its RAxML format partitions.
+
+    Support is an option like any other, e.g. B=1000 for ultrafast bootstrap
+    or alrt=1000 for SH-aLRT. Use one at a time, as both together label nodes
+    "aLRT/bootstrap", which ETE3 cannot read.
+    """
+
+    executable = "iqtree"
+
+    def run(self, msa, threads=1, name=None):
+        with TemporaryDirectory() as folder:
+            folder = Path(folder)
+            fasta = folder / "msa.fna"
+            fasta.write_text(msa.fasta())
+            cmd = [
+                self.executable,
+                "-s", str(fasta),
+                "-nt", str(threads),
+                "-pre", str(folder / "iqtree"),
+                "-quiet",
+                *format_flags(self.options),
+            ]
+            if isinstance(msa, MultiMSA) and len(msa.msas) > 1:
+                partitions = folder / "partitions.txt"
+                partitions.write_text(msa.raxml_partitions())
+                cmd.extend(["-p", str(partitions)])
+            process = timing.run(cmd, text=True, capture_output=True)
+            self.check(process)
+            return (folder / "iqtree.treefile").read_text().strip()
+
+
+RUNNERS = {"fasttree": FastTree, "iqtree": IQTree}
+
+
+def infer_trees(
+    mmsa,
+    runner="fasttree",
+    cpus=None,
+    concatenated=True,
+    gene_trees=True,
+    **options,
+):
+    """Infer a concatenated tree and one gene tree per marker concurrently.
+
+    `runner` is a key of RUNNERS or a TreeRunner instance; extra keyword
+    arguments are passed to the runner. Jobs share a budget of `cpus` cores:
+    at most `cpus` programs run at once, each given an equal share of
+    threads, with any remainder going to the concatenated tree.
+
+    The tree programs are the worker processes, so a thread pool is enough
+    to keep them running in parallel.
+
+    Returns a dict of CompactTree objects keyed by marker name, with the
+    concatenated tree under "concatenated".
+    """
+    if isinstance(runner, str):
+        runner = RUNNERS[runner](**options)
+
+    jobs = []
+    if concatenated:
+        jobs.append(("concatenated", mmsa))
+    if gene_trees and not (concatenated and len(mmsa.msas) == 1):
+        jobs.extend((msa.name, msa) for msa in mmsa)
+    if not jobs:
+        return {}
+
+    cpus = cpus or os.cpu_count() or 1
+    workers = min(len(jobs), cpus)
+    threads = max(1, cpus // workers)
+    extra = cpus - threads * workers if concatenated else 0
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            name: executor.submit(
+                timing.inherit(runner.run),
+                msa,
+                threads + extra if name == "concatenated" else threads,
+                name,
+            )
+            for name, msa in jobs
+        }
+        return {
+            name: CompactTree.from_newick(future.result())
+            for name, future in futures.items()
+        }
+
+
+def iqtree(msa, threads=1, **kwargs):
+    """Generate tree from MSA using IQ-Tree."""
+    return IQTree(**kwargs).run(msa, threads=threads)
+
+
+def fasttree(
+    msa, start_trees=None, full_run=False, name="concatenated", key=None, **kwargs
+):
+    """Run FastTree on an MSA.
+
+    If `start_trees` is given, the previous tree saved under `key` and
+    `name` is used as a starting topology; see FastTree.
+    """
+    runner = FastTree(start_trees=start_trees, full_run=full_run, key=key, **kwargs)
+    return runner.run(msa, name=name)
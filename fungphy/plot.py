@@ -1,8 +1,10 @@
 """Plot phylogenetic tree using ETE toolkit."""
 
-import csv
+import multiprocessing
+import os
 
-from collections import defaultdict
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
 
 from ete3 import Tree, TreeStyle, faces, NodeStyle
 from ete3.treeview.faces import DynamicItemFace, TextFace
@@ -11,6 +13,9 @@ from PyQt5.QtGui import QPen
 from PyQt5.QtWidgets import QGraphicsRectItem, QGraphicsTextItem
 
 import fungphy.phylogeny as phy
+from fungphy import metrics, timing
+from fungphy.compact import CompactTree
+from fungphy.compare import clade_bitsets, leaf_index
 from fungphy.database import session
 from fungphy.models import (
     Genus,
@@ -19,134 +24,14 @@ from fungphy.models import (
     Strain,
     StrainName,
     Subgenus,
-    Marker,
-    MarkerType,
 )
-
-
-def get_species(
-    genera=None,
-    subgenera=None,
-    sections=None,
-    species=None,
-    strains=None,
-    strain_ids=None,
-    markers=None,
-    types=False,
-):
-    """Query database for species."""
-    q = session.query(Strain).join(Species, Section, Subgenus, Genus)
-    if genera:
-        q = q.filter(Genus.name.in_(genera))
-    if subgenera:
-        q = q.filter(Subgenus.name.in_(subgenera))
-    if sections:
-        q = q.filter(Section.name.in_(sections))
-    if species:
-        q = q.filter(Species.epithet.in_(species))
-    if strains:
-        q = q.filter(
-            Strain.strain_names.any(StrainName.name.in_(strains))
-            | Species.type.in_(strains)
-        )
-    if strain_ids:
-        q = q.filter(Strain.id.in_(strain_ids))
-    if types:
-        q = q.filter(Strain.is_ex_type==True)
-    if markers:
-        mq = session.query(MarkerType).filter(MarkerType.name.in_(markers)).all()
-        if len(mq) != len(markers):
-            raise ValueError("Marker mismatch; misspelled marker name?")
-        q = q.filter(*[Strain.markers.any(marker_type=m) for m in mq])
-    return q.all()
-
-
-def get_marker_sequences(strains, marker, header_source="organism", header_attr="id"):
-    if header_source not in ("organism", "marker"):
-        raise ValueError("Expected 'organism' or 'marker'")
-
-    return [
-        phy.Sequence(
-            header=getattr(s if header_source == "organism" else m, header_attr),
-            sequence=m.sequence,
-        )
-        for s in strains
-        for m in s.markers
-        if m.marker == marker
-    ]
-
-
-class Summary:
-    """A summary table."""
-
-    def __init__(self, headers=None, rows=None):
-        self.headers = headers if headers else []
-        self.rows = rows if rows else []
-
-    def __iter__(self):
-        return iter(self.rows)
-
-    @classmethod
-    def from_strains(cls, strains, markers, delimiter=","):
-        accessions = []
-        for marker in markers:
-            a = [
-                m.header
-                for m in get_marker_sequences(
-                    strains, marker, header_source="marker", header_attr="accession"
-                )
-            ]
-            accessions.append(a)
-
-        headers = ["ID", "Genus", "Subgenus", "Section", "Species", "Strain", *markers]
-        rows = [
-            [s.id, s.species.genus, s.species.subgenus, s.species.section.name,
-             s.species.epithet, s.names, *accs]
-            for s, *accs in zip(strains, *accessions)
-        ]
-        return cls(headers, rows)
-
-    @classmethod
-    def from_table(cls, fp, has_headers=False, delimiter=","):
-        headers, rows = [], []
-
-        if has_headers:
-            headers = next(fp).strip().split(delimiter)
-
-        for row in fp:
-            row = row.strip().split(delimiter)
-            rows.append(row)
-
-        return cls(headers=headers, rows=rows)
-
-    def format(self, delimiter=",", show_headers=False):
-        def join(array):
-            return delimiter.join(str(element) for element in array)
-
-        rows = [self.headers, *self.rows] if show_headers else self.rows
-        return "\n".join(join(row) for row in rows)
-
-
-def match_strain_markers(strains, markers):
-    """Return subset of Strain objects possessing all specified markers."""
-    good, bad = [], []
-    for strain in strains:
-        if set(markers).issubset(strain.marker_types):
-            good.append(strain)
-        else:
-            bad.append(strain)
-    return good, bad
-
-
-def align_strains(strains, markers, **kwargs):
-    """Align markers from a list of Organism objects."""
-    msas = []
-    for marker in markers:
-        print(f"Aligning {marker}")
-        sequences = get_marker_sequences(strains, marker)
-        msa = phy.align_sequences(sequences, name=marker, **kwargs)
-        msas.append(msa)
-    return phy.MultiMSA(msas)
+from fungphy.query import (
+    Summary,
+    align_strains,
+    get_marker_sequences,
+    get_species,
+    match_strain_markers,
+)
 
 
 def layout(node):
@@ -205,18 +90,45 @@ def get_tree_style(**kwargs):
     style.show_leaf_name = False
 
     for key, value in kwargs.items():
-        if value == "True":
-            value = True
-        else:
-            try:
-                value = float(value)
-            except ValueError:
-                pass
-        setattr(style, key, value)
+        try:
+            setattr(style, key, tree_style_value(key, value))
+        except ValueError as error:
+            raise ValueError(f"Invalid TreeStyle parameter {key}={value!r}: {error}")
 
     return style
 
 
+def tree_style_value(key, value):
+    """Convert a TreeStyle parameter given as text (e.g. key=value arguments).
+
+    "True"/"False" become booleans and numeric strings numbers. Booleans,
+    numbers and None (e.g. from a JSON manifest) are kept as they are.
+    """
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    if not isinstance(value, str):
+        raise ValueError("expected a string, number or boolean")
+    if value in ("True", "False"):
+        return value == "True"
+    for number in (int, float):
+        try:
+            return number(value)
+        except ValueError:
+            pass
+    return value
+
+
+def handle_tree_style_kwargs(items):
+    """Parse -ts key=value pairs, shared by fungphy and fungphy-render."""
+    kwargs = {}
+    for item in items:
+        key, equals, value = item.partition("=")
+        if not (key and equals):
+            raise ValueError(f"Expected TreeStyle parameters as key=value, got: {item}")
+        kwargs[key] = value
+    return kwargs
+
+
 def add_support(node, support):
     try:
         node.multi_support.append(support)
@@ -224,12 +136,14 @@ def add_support(node, support):
         node.add_feature("multi_support", [node.support, support])
 
 
+@timing.span("merge_support")
 def merge_support_values(trees):
     """Combine support values for common nodes in two Trees.
 
-    Iterates all nodes in both trees, and combines support values if child leaves
-    are identical. Note that as ETE forces the `support` attribute to be a float,
-    the combined values are stored under `multi_support`.
+    Every internal node is keyed by the bitset of its child leaves, computed
+    once per tree, and support values of identical clades are merged through
+    dictionary lookups. Note that as ETE forces the `support` attribute to be
+    a float, the combined values are stored under `multi_support`.
 
     e.g. Posterior probability % = 100, bootstrap = 95 => 100/95
     """
@@ -240,21 +154,21 @@ def merge_support_values(trees):
     base, *others = trees
 
     new = base.copy()
-    new.add_feature("base_trees", trees)
-
-    for node in new.get_descendants():
-        leaves = node.get_leaf_names()
-        found_match = False
-        if not leaves:
-            continue
-        for other in others:
-            for node2 in other.get_descendants():
-                if set(leaves) != set(node2.get_leaf_names()):
-                    continue
-                add_support(node, node2.support)
-                found_match = True
-            if not found_match:
-                add_support(node, "-")
+    index = leaf_index(*trees)
+    nodes = [
+        (node, bits)
+        for node, bits in clade_bitsets(new, index).items()
+        if not node.is_leaf() and not node.is_root()
+    ]
+
+    for other in others:
+        supports = {
+            bits: node.support
+            for node, bits in clade_bitsets(other, index).items()
+            if not node.is_leaf()
+        }
+        for node, bits in nodes:
+            add_support(node, supports.get(bits, "-"))
 
     return new
 
@@ -280,23 +194,82 @@ def label_maker(node, label):
     return rect
 
 
-def add_section_annotations(tree: Tree) -> None:
+LeafMetadata = namedtuple(
+    "LeafMetadata",
+    ["id", "genus", "subgenus", "section", "epithet", "strain", "type", "is_ex_type"],
+)
+
+
+def query_leaf_metadata(ids):
+    """Fetch taxonomy and naming details of Strains in one flat query.
+
+    The first strain name of each Strain is selected by a correlated
+    subquery, so no relationships are lazily loaded per leaf.
+    """
+    first_name = (
+        session.query(StrainName.name)
+        .filter(StrainName.strain_id == Strain.id)
+        .order_by(StrainName.id)
+        .limit(1)
+        .correlate(Strain)
+        .as_scalar()
+    )
+    q = (
+        session.query(
+            Strain.id,
+            Genus.name,
+            Subgenus.name,
+            Section.name,
+            Species.epithet,
+            first_name,
+            Species.type,
+            Strain.is_ex_type,
+        )
+        .select_from(Strain)
+        .join(Species, Section, Subgenus, Genus)
+        .filter(Strain.id.in_(ids))
+    )
+    return {str(row[0]): LeafMetadata(*row) for row in q}
+
+
+def get_leaf_metadata(tree):
+    """Return LeafMetadata for each leaf of a Tree, keyed by leaf name.
+
+    Results are cached on the tree root, and only reloaded if the tree
+    gains leaves that were not previously loaded.
+    """
+    root = tree.get_tree_root()
+    leaves = root.get_leaf_names()
+    cached = getattr(root, "_leaf_metadata", None)
+    if cached is None or any(leaf not in cached for leaf in leaves):
+        metrics.cache_miss("leaf_metadata")
+        cached = query_leaf_metadata(leaves)
+        root._leaf_metadata = cached
+    else:
+        metrics.cache_hit("leaf_metadata")
+    return cached
+
+
+@timing.span("annotate_sections")
+def add_section_annotations(tree: Tree) -> list:
     """Annotates taxonomic sections.
 
     Pretty hacky. Finds first common ancestor of leaf nodes per section,
     then sets a bgcolor. If a section contains a single node, then only
-    that node is styled. Also adds a section label, but exact position
-    is determined by which node gets found first using search_nodes().
+    that node is styled. Also adds a section label to the first leaf of
+    the section in traversal order.
 
     Relies on accurate section annotation - FP strains were set to Talaromyces
     which breaks this.
+
+    Returns names of sections that are not monophyletic in the tree.
     """
-    leaves = tree.get_leaf_names()
-    sections = defaultdict(list)
-    for strain in session.query(Strain).filter(Strain.id.in_(leaves)):
-        if "FP" in strain.species.epithet:
-            continue
-        sections[strain.species.section.name].append(str(strain.id))
+    metadata = get_leaf_metadata(tree)
+    sections = {
+        leaf: metadata[leaf].section
+        for leaf in tree.get_leaf_names()
+        if leaf in metadata and "FP" not in metadata[leaf].epithet
+    }
 
     index = 0
     colours = [
@@ -309,27 +282,33 @@ def add_section_annotations(tree: Tree) -> None:
         "Thistle"
     ]
 
-    for section, ids in sections.items():
-        # Find MRCA and set bgcolor of its node
+    # CompactTree node indices follow the preorder traversal of the Tree
+    nodes = list(tree.traverse("preorder"))
+    clades = CompactTree.from_ete(tree).group_clades(sections)
+
+    non_monophyletic = []
+    for section, (mrca, leaf, monophyletic) in clades.items():
+        # Set bgcolor of the MRCA node
         style = NodeStyle()
         style["bgcolor"] = colours[index]
-        if len(ids) == 1:
-            node = tree.search_nodes(name=ids[0])[0]
-        else:
-            node = tree.get_common_ancestor(*ids)
-        node.set_style(style)
+        nodes[mrca].set_style(style)
 
-        # Grab first node found in this section, and add section label
-        node = tree.search_nodes(name=ids[0])[0]
+        # Add section label to first leaf found in this section
         face = faces.TextFace(section, fsize=20)
-        node.add_face(face, column=1, position="aligned")
+        nodes[leaf].add_face(face, column=1, position="aligned")
+
+        if not monophyletic:
+            non_monophyletic.append(section)
 
         # Wraparound colour scheme
         index += 1
         if index > len(colours) - 1:
             index = 0
 
+    return non_monophyletic
 
+
+@timing.span("label_leaves")
 def add_leaf_labels(tree, bold=None, types=None):
     """Form leaf labels for an ETE3 Tree object.
 
@@ -339,23 +318,18 @@ def add_leaf_labels(tree, bold=None, types=None):
     However, requires editing in .pdf format rather than .svg.
     """
 
-    leaves = tree.get_leaf_names()
-
-    strains = {
-        str(strain.id): strain
-        for strain in session.query(Strain).filter(Strain.id.in_(leaves))
-    }
+    strains = get_leaf_metadata(tree)
 
     for leaf in tree.iter_leaves():
         s = strains[leaf.name]
 
-        genus = s.species.genus
-        epithet = s.species.epithet
+        genus = s.genus
+        epithet = s.epithet
 
         use_type = True if types and epithet in types else False
         use_bold = True if bold and epithet in bold else False
 
-        name = s.strain_names[0].name if not use_type else s.species.type
+        name = s.strain if not use_type else s.type
         label = f"<i>{genus[0]}. {epithet}</i>  {name}"
 
         if s.is_ex_type and not use_type:
@@ -368,7 +342,7 @@ def add_leaf_labels(tree, bold=None, types=None):
 
 
 def set_outgroup(tree, species):
-    """Set an outgroup on an ETE3 Tree object."""
+    """Root a CompactTree on the strains of the given species."""
 
     leaves = tree.get_leaf_names()
 
@@ -379,28 +353,28 @@ def set_outgroup(tree, species):
     else:
         q = q.filter(Species.epithet.in_(species))
 
-    count = q.count()
+    outgroup = [str(record[0]) for record in q]
 
-    if count == 0:
+    if not outgroup:
         raise ValueError("Found no match for given species")
 
-    if count == 1:
-        node = str(q.first()[0])
-        tree.set_outgroup(node)
+    return tree.set_outgroup(outgroup)
 
-    elif count > 1:
-        node = tree.get_common_ancestor(*[str(record[0]) for record in q])
-        tree.set_outgroup(node)
 
+@timing.span("read_tree")
+def read_tree(nwk, outgroup=None, bold=None, types=None, label_leaves=True, flip=False):
+    """Read in a Newick format tree.
 
-def read_tree(nwk, outgroup=None, bold=None, types=None, label_leaves=True):
-    """Read in a Newick format tree."""
-    tree = Tree(nwk)
+    The tree is rooted and ladderized as a CompactTree, then converted to an
+    ETE3 Tree for annotation and rendering.
+    """
+    tree = CompactTree.from_newick(nwk)
+    if outgroup:
+        tree = set_outgroup(tree, outgroup)
+    tree = tree.ladderize(1 if flip else 0).to_ete()
     if label_leaves:
         add_section_annotations(tree)
         add_leaf_labels(tree, bold=bold, types=types)
-    if outgroup:
-        set_outgroup(tree, outgroup)
     return tree
 
 
@@ -410,13 +384,19 @@ def read_tree_from_path(path, **kwargs):
     return read_tree(nwk, **kwargs)
 
 
-def read_trees_from_paths(paths, merge=False, bold=None, types=None, outgroup=None):
+def read_trees_from_paths(
+    paths, merge=False, bold=None, types=None, outgroup=None, flip=False
+):
     trees = []
     for path in paths:
         if merge:
-            tree = read_tree(path, outgroup=outgroup, label_leaves=False)
+            tree = read_tree_from_path(
+                path, outgroup=outgroup, label_leaves=False, flip=flip
+            )
         else:
-            tree = read_tree(path, outgroup=outgroup, bold=bold, types=types)
+            tree = read_tree_from_path(
+                path, outgroup=outgroup, bold=bold, types=types, flip=flip
+            )
         trees.append(tree)
     if merge:
         tree = merge_support_values(trees)
@@ -434,6 +414,61 @@ def show(tree, ts=None):
     tree.show(tree_style=ts)
 
 
+@timing.span("render")
+def render(tree, path, ts=None, width=None, height=None, units="px", dpi=300):
+    """Render a Tree to file without a display.
+
+    Output format (PDF, SVG or PNG) is determined by the file extension. Qt is
+    set to use the offscreen platform unless QT_QPA_PLATFORM is already set.
+    """
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    if not ts:
+        ts = get_tree_style()
+    return tree.render(
+        str(path), tree_style=ts, w=width, h=height, units=units, dpi=dpi
+    )
+
+
+def render_job(job):
+    """Read, annotate and render one tree described by a manifest entry.
+
+    Expects a dict with keys `tree` (path, or list of paths to merge) and
+    `output`, and optionally `outgroup`, `bold`, `types`, `flip` and
+    `tree_style` (TreeStyle parameters).
+    """
+    paths = job["tree"]
+    if isinstance(paths, str):
+        paths = [paths]
+    tree = read_trees_from_paths(
+        paths,
+        merge=True,
+        bold=job.get("bold"),
+        types=job.get("types"),
+        outgroup=job.get("outgroup"),
+        flip=job.get("flip", False),
+    )
+    ts = get_tree_style(**job.get("tree_style", {}))
+    render(tree, job["output"], ts=ts, dpi=job.get("dpi", 300))
+    return job["output"]
+
+
+def _init_render_worker():
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+
+def render_trees(jobs, processes=None):
+    """Render many trees in a process pool.
+
+    Workers are spawned rather than forked, so no Qt or database state is
+    shared with the parent process. Returns output paths in job order.
+    """
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(
+        max_workers=processes, mp_context=context, initializer=_init_render_worker
+    ) as executor:
+        return list(executor.map(render_job, jobs))
+
+
 def _run(
     genera=None,
     subgenera=None,
@@ -0,0 +1,362 @@
+"""Query strains and marker sequences from the database.
+
+Kept free of ete3 and Qt so that the CLI and web views can fetch, export and
+align sequences without paying for the tree plotting imports.
+"""
+
+import threading
+
+from collections import OrderedDict
+
+from sqlalchemy import inspect, or_
+from sqlalchemy.orm import defer, joinedload, selectinload
+from sqlalchemy.orm.exc import MultipleResultsFound, NoResultFound
+from sqlalchemy.orm.attributes import set_committed_value
+
+import fungphy.phylogeny as phy
+from fungphy import metrics, timing
+from fungphy.compact import CompactTree
+from fungphy.database import session
+from fungphy.models import (
+    Genus,
+    Marker,
+    MarkerSequence,
+    Section,
+    Species,
+    Strain,
+    StrainName,
+    Subgenus,
+    MarkerType,
+    ReferenceTree,
+)
+
+
+@timing.span("query")
+def get_species(
+    genera=None,
+    subgenera=None,
+    sections=None,
+    species=None,
+    strains=None,
+    strain_ids=None,
+    markers=None,
+    types=False,
+    require_all_markers=True,
+):
+    """Query database for species.
+
+    If markers are given, only strains with all of them are returned, or
+    with any of them if require_all_markers is False.
+    """
+    q = session.query(Strain).join(Species, Section, Subgenus, Genus)
+    if genera:
+        q = q.filter(Genus.name.in_(genera))
+    if subgenera:
+        q = q.filter(Subgenus.name.in_(subgenera))
+    if sections:
+        q = q.filter(Section.name.in_(sections))
+    if species:
+        q = q.filter(Species.epithet.in_(species))
+    if strains:
+        q = q.filter(
+            Strain.strain_names.any(StrainName.name.in_(strains))
+            | Species.type.in_(strains)
+        )
+    if strain_ids:
+        q = q.filter(Strain.id.in_(strain_ids))
+    if types:
+        q = q.filter(Strain.is_ex_type==True)
+    if markers:
+        mq = session.query(MarkerType).filter(MarkerType.name.in_(markers)).all()
+        if len(mq) != len(markers):
+            raise ValueError("Marker mismatch; misspelled marker name?")
+        conditions = [Strain.markers.any(marker_type=m) for m in mq]
+        if require_all_markers:
+            q = q.filter(*conditions)
+        else:
+            q = q.filter(or_(*conditions))
+    return q.all()
+
+
+def chunked(items, size=500):
+    """Split a list into chunks, e.g. to stay under SQLite's variable limit."""
+    for start in range(0, len(items), size):
+        yield items[start : start + size]
+
+
+def load_markers(strains):
+    """Load the Markers (and their types) of many Strains in a few queries.
+
+    Strains whose markers are already loaded are skipped.
+    """
+    ids = [strain.id for strain in strains if "markers" in inspect(strain).unloaded]
+    for chunk in chunked(ids):
+        (
+            session.query(Strain)
+            .filter(Strain.id.in_(chunk))
+            .options(selectinload(Strain.markers).joinedload(Marker.marker_type))
+            .all()
+        )
+    return strains
+
+
+def load_taxonomy(strains):
+    """Load the names, species, section, subgenus and genus of many Strains.
+
+    Strains whose names and species are already loaded are skipped.
+    """
+    ids = [
+        strain.id
+        for strain in strains
+        if {"strain_names", "species"} & inspect(strain).unloaded
+    ]
+    for chunk in chunked(ids):
+        (
+            session.query(Strain)
+            .filter(Strain.id.in_(chunk))
+            .options(
+                selectinload(Strain.strain_names),
+                joinedload(Strain.species)
+                .joinedload(Species.section)
+                .joinedload(Section.subgenus)
+                .joinedload(Subgenus.genus),
+            )
+            .all()
+        )
+    return strains
+
+
+def undefer_sequences(strains):
+    """Load the Markers and sequences of many Strains in a few queries.
+
+    Marker sequences are not loaded with their Marker, so listing strains and
+    markers reads no sequence data. Reading Marker.sequence then costs one
+    query per marker, so code reading many sequences (export, alignment)
+    should call this first. Queries on Marker can instead use the
+    joinedload(Marker.stored_sequence) loader option.
+    """
+    load_markers(strains)
+    markers = [
+        marker
+        for strain in strains
+        for marker in strain.markers
+        if marker.sequence_hash and "stored_sequence" in inspect(marker).unloaded
+    ]
+    sequences = {}
+    for chunk in chunked(list({marker.sequence_hash for marker in markers})):
+        for stored in session.query(MarkerSequence).filter(MarkerSequence.hash.in_(chunk)):
+            sequences[stored.hash] = stored
+    for marker in markers:
+        set_committed_value(marker, "stored_sequence", sequences.get(marker.sequence_hash))
+    return strains
+
+
+@timing.span("sequences")
+def get_marker_sequences(strains, marker, header_source="organism", header_attr="id"):
+    if header_source not in ("organism", "marker"):
+        raise ValueError("Expected 'organism' or 'marker'")
+
+    undefer_sequences(strains)
+    return [
+        phy.Sequence(
+            header=getattr(s if header_source == "organism" else m, header_attr),
+            sequence=m.sequence,
+        )
+        for s in strains
+        for m in s.markers
+        if m.marker == marker
+    ]
+
+
+class Summary:
+    """A summary table."""
+
+    def __init__(self, headers=None, rows=None):
+        self.headers = headers if headers else []
+        self.rows = rows if rows else []
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    @classmethod
+    def from_strains(cls, strains, markers, delimiter=","):
+        load_markers(strains)
+        load_taxonomy(strains)
+
+        def accession(strain, marker):
+            m = strain.get_marker(marker)
+            return m.accession if m else ""
+
+        headers = ["ID", "Genus", "Subgenus", "Section", "Species", "Strain", *markers]
+        rows = [
+            [s.id, s.species.genus, s.species.subgenus, s.species.section.name,
+             s.species.epithet, s.names, *(accession(s, m) for m in markers)]
+            for s in strains
+        ]
+        return cls(headers, rows)
+
+    @classmethod
+    def from_table(cls, fp, has_headers=False, delimiter=","):
+        headers, rows = [], []
+
+        if has_headers:
+            headers = next(fp).strip().split(delimiter)
+
+        for row in fp:
+            row = row.strip().split(delimiter)
+            rows.append(row)
+
+        return cls(headers=headers, rows=rows)
+
+    def format(self, delimiter=",", show_headers=False):
+        def join(array):
+            return delimiter.join(str(element) for element in array)
+
+        rows = [self.headers, *self.rows] if show_headers else self.rows
+        return "\n".join(join(row) for row in rows)
+
+
+def match_strain_markers(strains, markers):
+    """Return subset of Strain objects possessing all specified markers."""
+    good, bad = [], []
+    for strain in strains:
+        if set(markers).issubset(strain.marker_types):
+            good.append(strain)
+        else:
+            bad.append(strain)
+    return good, bad
+
+
+def align_strains(strains, markers, pad_missing=False, checkpoints=None, **kwargs):
+    """Align markers from a list of Organism objects.
+
+    If pad_missing is True, strains lacking a marker are kept and padded
+    with gaps in that partition of the concatenated alignment.
+
+    If a checkpoint.Checkpoints is given, each marker alignment is stored
+    under stage align:<marker>, keyed by its sequences and alignment options,
+    and only realigned when those change.
+    """
+    msas = []
+    for marker in markers:
+        sequences = get_marker_sequences(strains, marker)
+        if not sequences:
+            print(f"No sequences for {marker}, skipping")
+            continue
+
+        def compute(marker=marker, sequences=sequences):
+            print(f"Aligning {marker}")
+            return phy.align_sequences(sequences, name=marker, **kwargs)
+
+        if checkpoints:
+            from fungphy.checkpoint import digest, digest_sequences
+
+            def key(marker=marker, sequences=sequences):
+                return digest(marker, digest_sequences(sequences), kwargs)
+
+            msa = checkpoints.msa(f"align:{marker}", key, compute)
+        else:
+            msa = compute()
+        msas.append(msa)
+    return phy.MultiMSA(msas, pad_missing=pad_missing)
+
+
+def get_reference_tree(genus=None, section=None):
+    """Get the most recently stored ReferenceTree for a section or genus.
+
+    If both are given, the section is looked up within the genus.
+    """
+    q = session.query(ReferenceTree)
+    if section:
+        q = q.join(Section).filter(Section.name == section)
+        if genus:
+            q = q.join(Subgenus, Genus).filter(Genus.name == genus)
+    elif genus:
+        q = q.join(Genus).filter(Genus.name == genus)
+    else:
+        raise ValueError("Expected genus or section")
+    reference = (
+        q.options(defer(ReferenceTree.newick))
+        .order_by(ReferenceTree.created.desc(), ReferenceTree.id.desc())
+        .first()
+    )
+    if not reference:
+        raise ValueError(f"No reference tree stored for {section or genus}")
+    return reference
+
+
+def one(q, description):
+    """Return the only result of a query, or raise a ValueError."""
+    try:
+        return q.one()
+    except NoResultFound:
+        raise ValueError(f"No {description} found") from None
+    except MultipleResultsFound:
+        raise ValueError(f"More than one {description} found; specify the genus") from None
+
+
+def save_reference_tree(newick, genus=None, section=None, description=None):
+    """Store a Newick tree, with Strain.id leaf names, as a reference tree.
+
+    If both genus and section are given, the section is looked up within the
+    genus, as section names may be shared between genera.
+    """
+    CompactTree.from_newick(newick)  # Fail early on malformed trees
+    reference = ReferenceTree(newick=newick, description=description)
+    if section:
+        q = session.query(Section).filter(Section.name == section)
+        if genus:
+            q = q.join(Subgenus, Genus).filter(Genus.name == genus)
+        reference.section = one(q, f"section {section}" + (f" in {genus}" if genus else ""))
+    elif genus:
+        reference.genus = one(
+            session.query(Genus).filter(Genus.name == genus), f"genus {genus}"
+        )
+    else:
+        raise ValueError("Expected genus or section")
+    session.add(reference)
+    session.commit()
+    return reference
+
+
+REFERENCE_CACHE_SIZE = 16
+
+_reference_cache = OrderedDict()
+_reference_lock = threading.Lock()
+
+
+def load_reference_tree(reference):
+    """Parse a ReferenceTree into a CompactTree, reusing recent parses.
+
+    Parses are keyed by tree ID and creation time, so the Newick text is only
+    loaded on a miss, and only the REFERENCE_CACHE_SIZE most recently used
+    trees are kept.
+    """
+    key = (reference.id, reference.created)
+    with _reference_lock:
+        tree = _reference_cache.get(key)
+        if tree is not None:
+            _reference_cache.move_to_end(key)
+    if tree is not None:
+        metrics.cache_hit("reference_tree")
+        return tree
+    metrics.cache_miss("reference_tree")
+    tree = CompactTree.from_newick(reference.newick)
+    with _reference_lock:
+        _reference_cache[key] = tree
+        while len(_reference_cache) > REFERENCE_CACHE_SIZE:
+            _reference_cache.popitem(last=False)
+    return tree
+
+
+def prune_reference_tree(strain_ids, genus=None, section=None):
+    """Prune a stored reference tree to the given Strain IDs.
+
+    Branch lengths and supports are kept, and unary nodes are suppressed.
+    Returns the pruned CompactTree and a list of IDs not found in the tree.
+    """
+    tree = load_reference_tree(get_reference_tree(genus=genus, section=section))
+    leaves = set(tree.get_leaf_names())
+    wanted = [str(i) for i in strain_ids]
+    missing = [i for i in wanted if i not in leaves]
+    return tree.prune(wanted), missing
@@ -0,0 +1,91 @@
+"""Render trees to PDF/SVG/PNG without a display."""
+
+import argparse
+import json
+
+from fungphy import plot
+
+
+def get_parser():
+    parser = argparse.ArgumentParser("fungphy-render")
+    parser.add_argument("-ma", "--manifest", help="JSON manifest of trees to render")
+    parser.add_argument("-ti", "--tree_in", nargs="+", help="Input tree file/s, merged")
+    parser.add_argument("-o", "--output", help="Output file (.pdf, .svg or .png)")
+    parser.add_argument("-ts", "--tree_style", nargs="+", help="ETE3 TreeStyle parameters as key=value pairs, as in fungphy")
+    parser.add_argument("-tb", "--tree_bold", nargs="+", help="Use bold leaf labels")
+    parser.add_argument("-tt", "--tree_type", nargs="+", help="Use type strain numbers")
+    parser.add_argument("-tf", "--tree_flip", action="store_true", help="Reverse tree ordering")
+    parser.add_argument("-og", "--outgroup", help="Outgroup species")
+    parser.add_argument("-p", "--processes", type=int, help="Number of render processes")
+    return parser
+
+
+def render(
+    manifest=None,
+    tree_in=None,
+    output=None,
+    tree_style=None,
+    tree_bold=None,
+    tree_type=None,
+    tree_flip=False,
+    outgroup=None,
+    processes=None,
+):
+    """Render trees listed in a manifest, or a single tree.
+
+    The manifest is a JSON list of objects as accepted by plot.render_job, e.g.
+        [{"tree": "Flavi.nw", "output": "Flavi.pdf", "outgroup": "avenaceus"}]
+
+    TreeStyle parameters of every job are checked before any tree is rendered.
+    """
+    jobs = []
+
+    if manifest:
+        with open(manifest) as fp:
+            jobs.extend(json.load(fp))
+
+    if tree_in:
+        if not output:
+            raise ValueError("Expected --output with --tree_in")
+        jobs.append(
+            {
+                "tree": tree_in,
+                "output": output,
+                "bold": tree_bold,
+                "types": tree_type,
+                "flip": tree_flip,
+                "outgroup": outgroup,
+                "tree_style": plot.handle_tree_style_kwargs(tree_style) if tree_style else {},
+            }
+        )
+
+    if not jobs:
+        raise ValueError("No trees to render")
+
+    for job in jobs:
+        options = job.get("tree_style", {})
+        if not isinstance(options, dict):
+            raise ValueError(f"Expected tree_style to be an object for: {job.get('output')}")
+        try:
+            plot.get_tree_style(**options)
+        except ValueError as error:
+            raise ValueError(f"{error} for: {job.get('output')}")
+
+    print(f"Rendering {len(jobs)} trees")
+    if len(jobs) == 1:
+        paths = [plot.render_job(jobs[0])]
+    else:
+        paths = plot.render_trees(jobs, processes=processes)
+    for path in paths:
+        print(f"Wrote: {path}")
+    return paths
+
+
+def main():
+    parser = get_parser()
+    args = parser.parse_args()
+    render(**vars(args))
+
+
+if __name__ == "__main__":
+    main()
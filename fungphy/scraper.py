@@ -1,8 +1,15 @@
 """Scrape aspergilluspenicillium.org using BeautifulSoup"""
 
+import hashlib
+import json
+import os
 import re
+import threading
 import unicodedata
 
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
 import requests
 
 from bs4 import BeautifulSoup
@@ -10,6 +17,8 @@ from bs4 import BeautifulSoup
 
 BASE = "https://www.aspergilluspenicillium.org"
 
+CACHE_DIR = Path(os.getenv("FUNGPHY_CACHE") or ".fungphy_cache") / "scraper"
+
 URLS = {
     "aspergillus-names": ["a-h", "i-p", "q-z"],
     "penicillium-names": ["a-h", "i-p", "q-z", "a-h-2", "i-p-2", "q-z-2"],
@@ -47,12 +56,94 @@ def iter_urls():
                 yield form_url(genus, span, letter)
 
 
-def get_species(url):
-    response = requests.get(url)
-    soup = BeautifulSoup(response.text, features="html.parser")
+class HTTPCache:
+    """On-disk HTTP cache honouring ETag/Last-Modified validators.
+
+    Each URL is stored as a pair of files named by the SHA1 of the URL: the
+    response body, and a JSON file holding its validators. Cached pages are
+    revalidated with a conditional GET, so unchanged pages come back as 304s
+    and are served from disk.
+    """
+
+    def __init__(self, directory=CACHE_DIR):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def _paths(self, url):
+        key = hashlib.sha1(url.encode()).hexdigest()
+        return self.directory / f"{key}.html", self.directory / f"{key}.json"
+
+    def validators(self, url):
+        """Return conditional request headers for a cached URL, if any."""
+        body, meta = self._paths(url)
+        if not (body.exists() and meta.exists()):
+            return {}
+        with open(meta) as fp:
+            stored = json.load(fp)
+        headers = {}
+        if stored.get("etag"):
+            headers["If-None-Match"] = stored["etag"]
+        if stored.get("last_modified"):
+            headers["If-Modified-Since"] = stored["last_modified"]
+        return headers
+
+    def load(self, url):
+        body, _ = self._paths(url)
+        return body.read_text(encoding="utf-8")
+
+    def save(self, url, response):
+        etag = response.headers.get("ETag")
+        last_modified = response.headers.get("Last-Modified")
+        if not (etag or last_modified):
+            return
+        body, meta = self._paths(url)
+        body.write_text(response.text, encoding="utf-8")
+        with open(meta, "w") as fp:
+            json.dump({"url": url, "etag": etag, "last_modified": last_modified}, fp)
+
+
+_local = threading.local()
+
+
+def get_session():
+    """Return a requests.Session private to the calling thread."""
+    if not hasattr(_local, "session"):
+        _local.session = requests.Session()
+    return _local.session
+
+
+def fetch(url, cache=None):
+    """GET a URL, revalidating against the cache if one is given."""
+    headers = cache.validators(url) if cache else {}
+    response = get_session().get(url, headers=headers)
+    if cache and response.status_code == 304:
+        return cache.load(url)
+    response.raise_for_status()
+    if cache:
+        cache.save(url, response)
+    return response.text
+
+
+def parse_species(html):
+    soup = BeautifulSoup(html, features="html.parser")
     return [sp.get_text() for sp in soup.find_all("p")]
 
 
+def get_species(url, cache=None):
+    return parse_species(fetch(url, cache=cache))
+
+
+def parse_entry(text):
+    """Parse a species paragraph into its fields, or None if it doesn't match.
+
+    Optional fields that are missing (e.g. no RPB2 accession) are empty strings.
+    """
+    match = PATTERN.search(text)
+    if not match:
+        return None
+    return [unicodedata.normalize("NFKD", g or "") for g in match.groups()]
+
+
 def write_table(species: list, output: str):
     """Write scraped species information to organism table""" 
     with open(output, "w") as fp:
@@ -61,20 +152,28 @@ def write_table(species: list, output: str):
             fp.write(fields)
 
 
-def scrape(urls=None):
+def scrape(urls=None, workers=8, cache_dir=CACHE_DIR):
+    """Scrape species entries from each URL.
+
+    Pages are fetched and parsed concurrently by a pool of at most `workers`
+    threads; results are collected in URL order. If `cache_dir` is given,
+    pages are cached there and revalidated on subsequent runs.
+    """
     if not urls:
         urls = iter_urls()
-    good, bad = [], []
-    for url in urls:
+    cache = HTTPCache(cache_dir) if cache_dir else None
+
+    def task(url):
         print(f"Scraping: {url}")
-        spp = get_species(url)
-        for sp in spp:
-            try:
-                groups = [
-                    unicodedata.normalize("NFKD", g)
-                    for g in PATTERN.search(sp).groups()
-                ]
-                good.append(groups)
-            except:
-                bad.append(sp)
+        return get_species(url, cache=cache)
+
+    good, bad = [], []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for spp in executor.map(task, urls):
+            for sp in spp:
+                groups = parse_entry(sp)
+                if groups:
+                    good.append(groups)
+                else:
+                    bad.append(sp)
     return good, bad
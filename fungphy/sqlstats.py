@@ -0,0 +1,213 @@
+"""Count SQL statements, to find N+1 query patterns and slow queries.
+
+Statements run on the engine are added to every Scope open in the current
+thread. A Scope counts statements, per timing stage if spans are active,
+flags parameterised statements repeated more than `repeat` times (usually a
+lazy load in a loop) and keeps the EXPLAIN QUERY PLAN of slow SELECTs:
+
+    with sqlstats.Scope("strains") as scope:
+        ...
+    print(scope.report())
+
+budget() fails if a block runs more statements than allowed, e.g. in a test.
+init_app() reports requests with repeated or slow statements in a Flask app.
+"""
+
+import threading
+import time
+
+from collections import Counter
+
+from sqlalchemy import event
+
+from fungphy import timing
+from fungphy.database import engine
+
+
+REPEAT_THRESHOLD = 10
+SLOW_QUERY = 0.1
+
+_local = threading.local()
+_observers = []
+
+
+def normalise(statement):
+    return " ".join(statement.split())
+
+
+def shorten(statement, width=120):
+    return statement if len(statement) <= width else statement[: width - 3] + "..."
+
+
+def open_scopes():
+    if not hasattr(_local, "scopes"):
+        _local.scopes = []
+    return _local.scopes
+
+
+def explain(cursor, statement, parameters):
+    """Return the SQLite query plan of a SELECT as indented lines."""
+    if not statement.lstrip().upper().startswith(("SELECT", "WITH")):
+        return []
+    try:
+        rows = cursor.connection.execute(
+            f"EXPLAIN QUERY PLAN {statement}", parameters
+        ).fetchall()
+    except Exception:
+        return []
+    depth, lines = {0: 0}, []
+    for node, parent, _, detail in rows:
+        depth[node] = depth.get(parent, 0) + 1
+        lines.append("  " * (depth[node] - 1) + detail)
+    return lines
+
+
+class Scope:
+    """SQL statements executed in this thread while the scope is open."""
+
+    def __init__(self, name="", repeat=REPEAT_THRESHOLD, slow=SLOW_QUERY):
+        self.name = name
+        self.repeat = repeat
+        self.slow = slow
+        self.count = 0
+        self.seconds = 0.0
+        self.statements = Counter()
+        self.stages = {}
+        self.slow_queries = []
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def start(self):
+        install()
+        open_scopes().append(self)
+        return self
+
+    def stop(self):
+        scopes = open_scopes()
+        if self in scopes:
+            scopes.remove(self)
+        return self
+
+    def add(self, statement, seconds, stage, plan=None):
+        self.count += 1
+        self.seconds += seconds
+        self.statements[statement] += 1
+        count, total = self.stages.get(stage, (0, 0.0))
+        self.stages[stage] = (count + 1, total + seconds)
+        if plan is not None:
+            self.slow_queries.append((statement, seconds, plan))
+
+    def repeated(self, threshold=None):
+        """Statements executed more than threshold times, most frequent first."""
+        threshold = self.repeat if threshold is None else threshold
+        if threshold is None:
+            return []
+        return [
+            (statement, count)
+            for statement, count in self.statements.most_common()
+            if count > threshold
+        ]
+
+    @property
+    def flagged(self):
+        return bool(self.slow_queries or self.repeated())
+
+    def report(self):
+        name = f" in {self.name}" if self.name else ""
+        lines = [f"{self.count} SQL statements{name} ({self.seconds:.3f} s)"]
+        if len(self.stages) > 1 or "" not in self.stages:
+            width = max(len(stage or "-") for stage in self.stages)
+            for stage, (count, seconds) in self.stages.items():
+                lines.append(f"  {stage or '-':<{width}}  {count:>6}  {seconds:>8.3f} s")
+        for statement, count in self.repeated():
+            lines.append(f"Repeated {count} times (possible N+1): {shorten(statement)}")
+        for statement, seconds, plan in self.slow_queries:
+            lines.append(f"Slow query ({seconds:.3f} s): {shorten(statement)}")
+            lines.extend(f"    {line}" for line in plan)
+        return "\n".join(lines)
+
+
+class BudgetExceeded(AssertionError):
+    pass
+
+
+class budget(Scope):
+    """Fail if a block runs more than `queries` statements.
+
+    If `repeat` is given, also fail if any statement runs more than `repeat`
+    times.
+    """
+
+    def __init__(self, queries, repeat=None, name=""):
+        super().__init__(name, repeat=repeat, slow=None)
+        self.queries = queries
+
+    def __exit__(self, exc_type, *exc):
+        self.stop()
+        if exc_type:
+            return
+        if self.count > self.queries:
+            raise BudgetExceeded(
+                f"Expected at most {self.queries} SQL statements, got {self.count}\n"
+                + self.report()
+            )
+        if self.repeat is not None and self.repeated():
+            raise BudgetExceeded(
+                f"Statements repeated more than {self.repeat} times\n" + self.report()
+            )
+
+
+def add_observer(observer):
+    """Call observer(statement, seconds) after every statement on the engine."""
+    if observer not in _observers:
+        _observers.append(observer)
+
+
+def before_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("fungphy_query_start", []).append(time.perf_counter())
+
+
+def after_execute(conn, cursor, statement, parameters, context, executemany):
+    seconds = time.perf_counter() - conn.info["fungphy_query_start"].pop()
+    for observer in _observers:
+        observer(statement, seconds)
+    scopes = open_scopes()
+    if not scopes:
+        return
+    statement = normalise(statement)
+    stage = "/".join(timing.recorder.stack())
+    plan = None
+    slow = [scope.slow for scope in scopes if scope.slow is not None]
+    if slow and seconds >= min(slow) and not executemany and conn.dialect.name == "sqlite":
+        plan = explain(cursor, statement, parameters)
+    for scope in scopes:
+        scope_plan = plan if scope.slow is not None and seconds >= scope.slow else None
+        scope.add(statement, seconds, stage, scope_plan)
+
+
+def install(bind=engine):
+    """Listen to statements executed on an engine; safe to call repeatedly."""
+    if not event.contains(bind, "after_cursor_execute", after_execute):
+        event.listen(bind, "before_cursor_execute", before_execute)
+        event.listen(bind, "after_cursor_execute", after_execute)
+
+
+def init_app(app, repeat=REPEAT_THRESHOLD, slow=SLOW_QUERY):
+    """Print a report for each request with repeated or slow statements."""
+    from flask import g, request
+
+    install()
+
+    @app.before_request
+    def start_sql_scope():
+        g.sql_scope = Scope(request.path, repeat=repeat, slow=slow).start()
+
+    @app.teardown_request
+    def report_sql_scope(exception=None):
+        scope = g.pop("sql_scope", None)
+        if scope and scope.stop().flagged:
+            print(scope.report())
@@ -0,0 +1,409 @@
+"""Populate a fungphy database with synthetic, deterministic data.
+
+Builds a taxonomy of genera, subgenera, sections and species with Latin-like
+names and uneven section sizes, strains held in several culture collections
+(including near-identical designations such as "CBS 123.45" and
+"CBS123.45", and the same number in different collections), synonymous
+species and marker sequences. Sequences evolve down the taxonomy (genus,
+section, species, strain), so alignments and trees built from them have
+realistic structure. Some strains lack some markers, and some share
+identical sequences with other strains of their species.
+
+Rows are generated section by section and written with executemany in one
+transaction, so memory use stays bounded for multi-GB databases. The same
+arguments and seed always produce the same database.
+"""
+
+import argparse
+import math
+import random
+
+from pathlib import Path
+
+import numpy as np
+
+from sqlalchemy import create_engine
+
+from fungphy.database import Base
+from fungphy.models import (
+    Genus,
+    Marker,
+    MarkerSequence,
+    MarkerType,
+    Section,
+    Species,
+    Strain,
+    StrainName,
+    Subgenus,
+)
+
+
+MARKERS = {"ITS": 550, "BenA": 450, "CaM": 550, "RPB2": 950}
+
+COLLECTIONS = ("CBS", "NRRL", "ATCC", "IMI", "DTO", "IBT", "FRR", "KACC", "CGMCC")
+
+SYLLABLES = (
+    "a", "al", "an", "ar", "bi", "ca", "ce", "chi", "co", "cu", "da", "di",
+    "fla", "fu", "gla", "la", "le", "li", "lo", "ma", "mi", "mo", "na", "ni",
+    "no", "pa", "pe", "pi", "ra", "re", "ri", "ro", "sa", "se", "si", "ta",
+    "te", "ti", "to", "tu", "va", "ve", "vi", "ze",
+)
+SUFFIXES = ("us", "ensis", "icola", "atus", "oides", "iformis", "inus", "ianus")
+
+# Models in insertion order, parents before children
+TABLES = (
+    Genus,
+    Subgenus,
+    Section,
+    Species,
+    Strain,
+    StrainName,
+    MarkerType,
+    MarkerSequence,
+    Marker,
+)
+
+BASES = np.frombuffer(b"ACGT", dtype=np.uint8)
+
+# Substitution rates applied at each level of the taxonomy
+DIVERGENCE = {"section": 0.08, "species": 0.02, "strain": 0.003}
+
+
+def latin(rng, syllables=(2, 4), suffix=True):
+    """Generate a Latin-like name from random syllables."""
+    name = "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(*syllables)))
+    if suffix:
+        name += rng.choice(SUFFIXES)
+    return name
+
+
+def unique_name(rng, taken, **kwargs):
+    """Generate a name not in taken, and add it to taken."""
+    while True:
+        name = latin(rng, **kwargs)
+        if name in taken:
+            name += rng.choice(("ii", "ae", "um"))
+        if name not in taken:
+            taken.add(name)
+            return name
+
+
+def section_sizes(rng, strains, mean=40):
+    """Split a number of strains into uneven section sizes.
+
+    Sizes are drawn from a lognormal distribution, as most sections are
+    small and a few are very large.
+    """
+    sizes, total = [], 0
+    while total < strains:
+        size = max(1, int(rng.lognormvariate(math.log(mean) - 0.5, 1.0)))
+        size = min(size, strains - total)
+        sizes.append(size)
+        total += size
+    return sizes
+
+
+def mutate(nprng, sequence, rate):
+    """Substitute a fraction of sites with random bases."""
+    mutated = sequence.copy()
+    sites = nprng.random(sequence.shape) < rate
+    mutated[sites] = nprng.choice(BASES, size=int(sites.sum()))
+    return mutated
+
+
+class StrainNamer:
+    """Issue unique strain designations, some deliberately similar.
+
+    Most designations are a collection prefix and a new number. A fraction
+    reuse a number already issued in a different collection, or differ from
+    an existing designation only by formatting.
+    """
+
+    def __init__(self, rng, collisions=0.05):
+        self.rng = rng
+        self.collisions = collisions
+        self.names = set()
+        self.issued = []
+        self.counter = 100
+
+    def new(self):
+        self.counter += self.rng.randint(1, 40)
+        number = str(self.counter)
+        if self.rng.random() < 0.5:
+            number = f"{number}.{self.rng.randint(50, 99)}"
+        prefix = self.rng.choice(COLLECTIONS)
+        self.issued.append((prefix, number))
+        return f"{prefix} {number}"
+
+    def similar(self):
+        prefix, number = self.rng.choice(self.issued)
+        if self.rng.random() < 0.5:
+            return f"{self.rng.choice(COLLECTIONS)} {number}"
+        return self.rng.choice(
+            (f"{prefix}{number}", f"{prefix}-{number}", f"{prefix} {number}T")
+        )
+
+    def __call__(self):
+        name = None
+        if self.issued and self.rng.random() < self.collisions:
+            name = self.similar()
+        if not name or name in self.names:
+            name = self.new()
+        self.names.add(name)
+        return name
+
+
+class Populator:
+    """Generate synthetic rows and write them in batches."""
+
+    def __init__(
+        self,
+        connection,
+        seed=0,
+        missing=0.1,
+        identical=0.3,
+        synonyms=0.05,
+        collisions=0.05,
+        batch=10000,
+    ):
+        self.connection = connection
+        self.rng = random.Random(seed)
+        self.nprng = np.random.default_rng(seed)
+        self.namer = StrainNamer(self.rng, collisions=collisions)
+        self.missing = missing
+        self.identical = identical
+        self.synonyms = synonyms
+        self.batch = batch
+        self.rows = {model: [] for model in TABLES}
+        self.counts = dict.fromkeys(TABLES, 0)
+        self.marker_types = {}
+        self.sequence_hashes = set()
+
+    def add(self, model, **row):
+        """Buffer a row, assigning the next id if it has one; return the id."""
+        self.counts[model] += 1
+        if "id" in model.__table__.c:
+            row.setdefault("id", self.counts[model])
+        self.rows[model].append(row)
+        if len(self.rows[model]) >= self.batch:
+            self.flush()
+        return row.get("id")
+
+    def add_sequence(self, sequence):
+        """Add a sequence unless already stored; return its hash."""
+        key = MarkerSequence.digest(sequence)
+        if key not in self.sequence_hashes:
+            self.sequence_hashes.add(key)
+            self.add(MarkerSequence, hash=key, sequence=sequence)
+        return key
+
+    def flush(self):
+        """Write buffered rows of every table, parents first."""
+        for model in TABLES:
+            if self.rows[model]:
+                self.connection.execute(model.__table__.insert(), self.rows[model])
+                self.rows[model] = []
+
+    def add_marker_types(self, markers):
+        for name, length in markers.items():
+            self.marker_types[name] = (
+                self.add(MarkerType, name=name, description=f"Synthetic {name}"),
+                length,
+            )
+
+    def add_genus(self, name, sizes):
+        """Add a genus with sections of the given sizes, in subgenera of 2-8."""
+        genus_id = self.add(Genus, name=name)
+        ancestors = {
+            name: self.nprng.choice(BASES, size=length)
+            for name, (_, length) in self.marker_types.items()
+        }
+        subgenus_names = set()
+        while sizes:
+            take = self.rng.randint(2, 8)
+            chunk, sizes = sizes[:take], sizes[take:]
+            name = unique_name(self.rng, subgenus_names, suffix=False).capitalize()
+            subgenus_id = self.add(Subgenus, name=f"{name}ati", genus_id=genus_id)
+            section_names = set()
+            for size in chunk:
+                name = unique_name(self.rng, section_names, suffix=False).capitalize()
+                section_id = self.add(Section, name=name, subgenus_id=subgenus_id)
+                self.add_section(section_id, size, ancestors)
+
+    def add_section(self, section_id, size, ancestors):
+        """Add species of 1-3 strains each until size strains are added."""
+        sequences = {
+            name: mutate(self.nprng, sequence, DIVERGENCE["section"])
+            for name, sequence in ancestors.items()
+        }
+        epithets, species_ids = set(), []
+        while size > 0:
+            count = min(size, self.rng.choice((1, 1, 1, 2, 3)))
+            size -= count
+            parent = None
+            if species_ids and self.rng.random() < self.synonyms:
+                parent = self.rng.choice(species_ids)
+            names = [self.namer() for _ in range(count)]
+            year = self.rng.randint(1900, 2020)
+            # The holotype is often also held as a living ex-type culture
+            holotype = names[0]
+            if self.rng.random() < 0.5:
+                holotype = f"{self.rng.choice(COLLECTIONS)} H-{year}"
+            species_id = self.add(
+                Species,
+                epithet=unique_name(self.rng, epithets),
+                type=holotype,
+                mycobank=f"MB{100000 + self.counts[Species]}",
+                reference=f"Synthetic et al. {year}",
+                section_id=section_id,
+                parent_id=parent,
+            )
+            species_ids.append(species_id)
+            species_sequences = {
+                name: mutate(self.nprng, sequence, DIVERGENCE["species"])
+                for name, sequence in sequences.items()
+            }
+            for i, name in enumerate(names):
+                self.add_strain(species_id, name, i == 0, species_sequences)
+
+    def add_strain(self, species_id, name, is_ex_type, sequences):
+        """Add a strain with 1-3 designations and most of its markers."""
+        strain_id = self.add(Strain, species_id=species_id, is_ex_type=is_ex_type)
+        extra = [self.namer() for _ in range(self.rng.randint(0, 2))]
+        for designation in [name, *extra]:
+            self.add(StrainName, name=designation, strain_id=strain_id)
+        for marker, sequence in sequences.items():
+            if self.rng.random() < self.missing:
+                continue
+            # Identical to any other strain of the species drawing it too
+            if self.rng.random() >= self.identical:
+                sequence = mutate(self.nprng, sequence, DIVERGENCE["strain"])
+                # Partial sequences: trim up to 2% off either end
+                start = self.rng.randint(0, len(sequence) // 50)
+                end = len(sequence) - self.rng.randint(0, len(sequence) // 50)
+                sequence = sequence[start:end]
+            number = self.counts[Marker] + 1
+            self.add(
+                Marker,
+                accession=f"{'MN' if number % 2 else 'OK'}{number:06d}",
+                sequence_hash=self.add_sequence(sequence.tobytes().decode("ascii")),
+                marker_type_id=self.marker_types[marker][0],
+                strain_id=strain_id,
+            )
+
+
+def populate(
+    path,
+    strains=1000,
+    genera=None,
+    markers=None,
+    seed=0,
+    missing=0.1,
+    identical=0.3,
+    synonyms=0.05,
+    collisions=0.05,
+    batch=10000,
+):
+    """Create a fungphy SQLite database filled with synthetic data.
+
+    Parameters:
+        path: SQLite database file, which must not exist yet
+        strains: total number of strains
+        genera: number of genera (default: one per 5000 strains)
+        markers: dict of marker name to sequence length (default: MARKERS)
+        seed: random seed
+        missing: probability of a strain lacking each marker
+        identical: probability of a marker sequence being identical to that of
+            other strains of the species
+        synonyms: probability of a species being a synonym of another
+        collisions: probability of a strain name resembling an existing one
+        batch: rows per executemany call
+
+    Returns a dict of row counts per table, and the genus names.
+    """
+    path = Path(path)
+    if path.exists():
+        raise FileExistsError(f"Database already exists: {path}")
+
+    genera = genera or max(strains // 5000, 1)
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(engine)
+
+    with engine.begin() as connection:
+        connection.execute("PRAGMA synchronous=OFF")
+        populator = Populator(
+            connection,
+            seed=seed,
+            missing=missing,
+            identical=identical,
+            synonyms=synonyms,
+            collisions=collisions,
+            batch=batch,
+        )
+        populator.add_marker_types(markers or MARKERS)
+
+        rng = populator.rng
+        names, sizes = set(), section_sizes(rng, strains)
+        genus_names = [
+            unique_name(rng, names, syllables=(2, 3), suffix=False).capitalize() + "us"
+            for _ in range(genera)
+        ]
+        for i, name in enumerate(genus_names):
+            populator.add_genus(name, sizes[i::genera])
+        populator.flush()
+
+    engine.dispose()
+    summary = {
+        model.__tablename__: count for model, count in populator.counts.items()
+    }
+    summary["genera"] = genus_names
+    return summary
+
+
+def parse_markers(items):
+    """Parse marker=length pairs, e.g. ["ITS=550", "BenA"]."""
+    markers = {}
+    for item in items:
+        name, _, length = item.partition("=")
+        markers[name] = int(length) if length else MARKERS.get(name, 500)
+    return markers
+
+
+def get_parser():
+    parser = argparse.ArgumentParser("fungphy-synth")
+    parser.add_argument("database", help="SQLite database file to create")
+    parser.add_argument("-n", "--strains", type=int, default=1000, help="Number of strains")
+    parser.add_argument("-g", "--genera", type=int, help="Number of genera (default: one per 5000 strains)")
+    parser.add_argument("-m", "--markers", nargs="+", help="Markers and sequence lengths, e.g. ITS=550 BenA=450")
+    parser.add_argument("-s", "--seed", type=int, default=0, help="Random seed")
+    parser.add_argument("--missing", type=float, default=0.1, help="Probability of a strain lacking each marker")
+    parser.add_argument("--identical", type=float, default=0.3, help="Probability of a marker sequence being identical within its species")
+    parser.add_argument("--synonyms", type=float, default=0.05, help="Probability of a species being a synonym")
+    parser.add_argument("--collisions", type=float, default=0.05, help="Probability of a strain name resembling another")
+    parser.add_argument("--batch", type=int, default=10000, help="Rows per bulk insert")
+    return parser
+
+
+def main():
+    parser = get_parser()
+    args = parser.parse_args()
+    print(f"Populating {args.database} with {args.strains} synthetic strains")
+    summary = populate(
+        args.database,
+        strains=args.strains,
+        genera=args.genera,
+        markers=parse_markers(args.markers) if args.markers else None,
+        seed=args.seed,
+        missing=args.missing,
+        identical=args.identical,
+        synonyms=args.synonyms,
+        collisions=args.collisions,
+        batch=args.batch,
+    )
+    print(f"Genera: {', '.join(summary.pop('genera'))}")
+    for table, count in summary.items():
+        print(f"  {table}: {count}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,251 @@
+"""Lightweight stage timing.
+
+Code marks stages with span(), as a context manager or decorator:
+
+    with timing.span("align"):
+        ...
+
+    @timing.span("trim")
+    def trim(...):
+        ...
+
+and runs external programs through timing.run(), which also records the CPU
+time used by the child process. Spans nest per thread, so a span opened
+inside "align" is recorded as "align/mafft".
+
+Nothing is recorded until enable() is called, so spans cost a single
+attribute check otherwise. report() summarises recorded spans as a table,
+and write_trace() saves them as a Chrome trace (chrome://tracing, Perfetto).
+
+Listeners added with add_listener() are told when every span starts and
+finishes, whether or not recording is enabled (see fungphy.metrics).
+"""
+
+import functools
+import json
+import os
+import subprocess
+import threading
+import time
+
+from collections import namedtuple
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+
+Record = namedtuple("Record", "name start wall cpu thread child_cpu")
+
+
+class Recorder:
+    """Collect timing records from all threads."""
+
+    def __init__(self):
+        self.enabled = False
+        self.listeners = []
+        self.records = []
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.origin = time.perf_counter()
+
+    def stack(self):
+        if not hasattr(self.local, "stack"):
+            self.local.stack = []
+        return self.local.stack
+
+    def add(self, record):
+        with self.lock:
+            self.records.append(record)
+
+
+recorder = Recorder()
+
+
+def enable():
+    """Start recording spans, discarding any previous records."""
+    recorder.records = []
+    recorder.origin = time.perf_counter()
+    recorder.enabled = True
+
+
+def disable():
+    recorder.enabled = False
+
+
+def add_listener(listener):
+    """Add an object with span_started(span) and span_finished(span) methods.
+
+    Finished spans have path, wall, cpu and child_cpu attributes, and
+    program set to True for external programs run with run().
+    """
+    if listener not in recorder.listeners:
+        recorder.listeners.append(listener)
+
+
+def remove_listener(listener):
+    if listener in recorder.listeners:
+        recorder.listeners.remove(listener)
+
+
+class span:
+    """Time a block of code, or every call of a decorated function."""
+
+    def __init__(self, name, program=False):
+        self.name = name
+        self.program = program
+
+    def __enter__(self):
+        self.child_cpu = 0.0
+        if not (recorder.enabled or recorder.listeners):
+            self.path = None
+            return self
+        stack = recorder.stack()
+        stack.append(self.name)
+        self.path = "/".join(stack)
+        self.start = time.perf_counter()
+        self.cpu = time.thread_time()
+        for listener in recorder.listeners:
+            listener.span_started(self)
+        return self
+
+    def __exit__(self, *exc):
+        if self.path is None:
+            return
+        recorder.stack().pop()
+        self.wall = time.perf_counter() - self.start
+        self.cpu = time.thread_time() - self.cpu
+        if recorder.enabled:
+            recorder.add(
+                Record(
+                    self.path,
+                    self.start - recorder.origin,
+                    self.wall,
+                    self.cpu,
+                    threading.get_ident(),
+                    self.child_cpu,
+                )
+            )
+        for listener in recorder.listeners:
+            listener.span_finished(self)
+
+    def __call__(self, function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(self.name):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+
+def inherit(function):
+    """Wrap a function to run under the calling thread's open spans.
+
+    Used when submitting work to a thread pool, so spans opened by the
+    worker are nested under the submitting stage.
+    """
+    parents = list(recorder.stack())
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        stack = recorder.stack()
+        saved = stack[:]
+        stack[:] = parents
+        try:
+            return function(*args, **kwargs)
+        finally:
+            stack[:] = saved
+
+    return wrapper
+
+
+def children_cpu():
+    """Total user + system CPU time of finished child processes."""
+    if resource is None:
+        return 0.0
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def run(cmd, name=None, **kwargs):
+    """subprocess.run, recorded as a span named after the program.
+
+    Child CPU time is the change in RUSAGE_CHILDREN over the call, so
+    programs running concurrently in other threads may be counted against
+    each other; totals across spans are still correct.
+    """
+    name = name or os.path.basename(str(cmd[0]))
+    if not (recorder.enabled or recorder.listeners):
+        return subprocess.run(cmd, **kwargs)
+    before = children_cpu()
+    with span(name, program=True) as timer:
+        process = subprocess.run(cmd, **kwargs)
+        timer.child_cpu = children_cpu() - before
+    return process
+
+
+def peak_rss():
+    """Peak resident set size of this process and its children, in MB."""
+    if resource is None:
+        return None, None
+    self_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children_kb = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return self_kb / 1024, children_kb / 1024
+
+
+def summary():
+    """Aggregate records by span name, in order of first start.
+
+    Returns a list of (name, calls, wall, cpu, child_cpu) tuples.
+    """
+    totals = {}
+    for record in sorted(recorder.records, key=lambda record: record.start):
+        calls, wall, cpu, child = totals.get(record.name, (0, 0.0, 0.0, 0.0))
+        totals[record.name] = (
+            calls + 1,
+            wall + record.wall,
+            cpu + record.cpu,
+            child + record.child_cpu,
+        )
+    return [(name, *values) for name, values in totals.items()]
+
+
+def report():
+    """Format recorded spans as a table, with peak memory use."""
+    rows = summary()
+    width = max([len("stage")] + [len(name) for name, *_ in rows])
+    header = ("calls", "wall (s)", "cpu (s)", "child cpu (s)")
+    lines = [f"{'stage':<{width}}  {'  '.join(header)}"]
+    for name, calls, wall, cpu, child in rows:
+        lines.append(
+            f"{name:<{width}}  {calls:>5}  {wall:>8.3f}  {cpu:>7.3f}  {child:>13.3f}"
+        )
+    lines.append(f"Total: {time.perf_counter() - recorder.origin:.3f} s")
+    self_rss, children_rss = peak_rss()
+    if self_rss is not None:
+        lines.append(
+            f"Peak RSS: {self_rss:.1f} MB (fungphy), "
+            f"{children_rss:.1f} MB (largest child process)"
+        )
+    return "\n".join(lines)
+
+
+def write_trace(path):
+    """Write recorded spans as Chrome trace events in JSON."""
+    pid = os.getpid()
+    events = [
+        {
+            "name": record.name.rsplit("/", 1)[-1],
+            "cat": record.name,
+            "ph": "X",
+            "ts": record.start * 1e6,
+            "dur": record.wall * 1e6,
+            "pid": pid,
+            "tid": record.thread,
+            "args": {"cpu": record.cpu, "child_cpu": record.child_cpu},
+        }
+        for record in recorder.records
+    ]
+    with open(path, "w") as fp:
+        json.dump({"traceEvents": events}, fp)
@@ -1,18 +1,21 @@
 import io
+import math
 import time
 import zipfile
 
 from collections import defaultdict
 
-from flask import Blueprint, render_template, jsonify, request, send_file
+from flask import Blueprint, Response, render_template, jsonify, request, send_file
 from flask import current_app as app
 from sqlalchemy import func
 from sqlalchemy.ext import compiler
+from sqlalchemy.orm import contains_eager, joinedload, selectinload
 from sqlalchemy.sql import ColumnElement
 
 from fungphy.database import session
-from fungphy import plot
 from fungphy import phylogeny as phy
+from fungphy import query
+from fungphy import writers
 from fungphy.models import (
     Strain,
     Species,
@@ -69,6 +72,9 @@ def compile_group_fasta(element, compiler, **kw):
 
 def form_zip(records):
     """Creates a .zip file in memory containing the given records.
+
+    Record content is either a string or an iterable of string chunks (e.g.
+    from fungphy.writers), which is compressed as it is generated.
     """
     memory = io.BytesIO()
     with zipfile.ZipFile(memory, mode="w") as zip_file:
@@ -76,7 +82,11 @@ def form_zip(records):
             data = zipfile.ZipInfo(record["name"])
             data.date_time = time.localtime(time.time())[:6]
             data.compress_type = zipfile.ZIP_DEFLATED
-            zip_file.writestr(data, record["content"])
+            if isinstance(record["content"], str):
+                zip_file.writestr(data, record["content"])
+                continue
+            with io.TextIOWrapper(zip_file.open(data, "w"), encoding="utf-8") as fp:
+                fp.writelines(record["content"])
     memory.seek(0)
     return memory
 
@@ -104,6 +114,7 @@ def get_marker_sequences():
         .join(Strain)
         .filter(Strain.id.in_(content["strains"]))
         .filter(MarkerType.name.in_(content["markers"]))
+        .options(joinedload(Marker.stored_sequence))
         .order_by(Marker.marker_type_id)
     )
 
@@ -148,14 +159,20 @@ def get_marker_sequences():
                 )
 
             if content["concatenated"]:
-                msa = phy.MultiMSA([msa for msa in records.values()])
+                msa = phy.MultiMSA(
+                    [msa for msa in records.values()], pad_missing=True
+                )
                 archive = form_zip([
-                    {"name": "markers.fna", "content": msa.fasta()},
-                    {"name": "partitions.text", "content": msa.raxml_partitions()},
+                    {"name": "markers.fna", "content": writers.iter_fasta(msa)},
+                    {"name": "markers.nex", "content": writers.iter_nexus(msa)},
+                    {
+                        "name": "partitions.text",
+                        "content": writers.iter_raxml_partitions(msa),
+                    },
                 ])
             else:
                 msas = [
-                    {"name": f"{marker}.fna", "content": msa.fasta()}
+                    {"name": f"{marker}.fna", "content": writers.iter_fasta(msa)}
                     for marker, msa in records.items()
                 ]
                 archive = form_zip(msas)
@@ -187,10 +204,104 @@ def get_marker_alignment():
     ids = content["ids"].split(",")
     markers = content["markers"].split(",")
 
-    strains = plot.get_species(strain_ids=ids)
-    msa = plot.align_strains(strains, markers, trim_msa=True)
+    strains = query.get_species(strain_ids=ids)
+    msa = query.align_strains(strains, markers, pad_missing=True, trim_msa=True)
+
+    return Response(writers.iter_fasta(msa), mimetype="text/plain")
+
+
+@view.route("/react/distances", methods=["POST"])
+def get_distance_matrix():
+    """Align markers of the requested strains and return pairwise distances.
+
+    Expects JSON with `strains` (Strain IDs) and `markers`, and optionally
+    `model` (p, jc69 or k2p; default k2p) and `format` (json or phylip).
+    Strains lacking a marker are padded with gaps, so pairs with no
+    comparable sites are null.
+    """
+    from fungphy import distance
+
+    content = request.get_json()
+
+    if not content or not (content.get("strains") and content.get("markers")):
+        return "Expected strains and markers", 404
+
+    model = content.get("model", "k2p")
+    if model not in distance.MODELS:
+        return f"Expected model in: {', '.join(distance.MODELS)}", 404
+
+    strains = query.get_species(strain_ids=content["strains"])
+    msa = query.align_strains(strains, content["markers"], pad_missing=True, trim_msa=True)
+    headers, matrix = distance.distance_matrix(msa, model=model)
+
+    if content.get("format") == "phylip":
+        handle = io.StringIO()
+        distance.write_phylip(handle, headers, matrix)
+        return handle.getvalue()
+
+    return {
+        "headers": headers,
+        "matrix": [
+            [value if math.isfinite(value) else None for value in row]
+            for row in matrix.tolist()
+        ],
+    }
+
+
+@view.route("/react/quicktree", methods=["POST"])
+def get_quick_tree():
+    """Align markers of the requested strains and build a neighbour-joining tree.
+
+    Expects JSON with `strains` (Strain IDs) and `markers`, and optionally
+    `model` (p, jc69 or k2p; default k2p). Strains sharing no comparable
+    sites with the others cannot be placed, and are listed in `missing`.
+    """
+    from fungphy import distance
+
+    content = request.get_json()
+
+    if not content or not (content.get("strains") and content.get("markers")):
+        return "Expected strains and markers", 404
+
+    model = content.get("model", "k2p")
+    if model not in distance.MODELS:
+        return f"Expected model in: {', '.join(distance.MODELS)}", 404
+
+    strains = query.get_species(strain_ids=content["strains"])
+    msa = query.align_strains(strains, content["markers"], pad_missing=True, trim_msa=True)
+    headers, matrix = distance.distance_matrix(msa, model=model)
+    headers, matrix, missing = distance.comparable(headers, matrix)
+
+    try:
+        tree = distance.neighbour_joining(headers, matrix)
+    except ValueError as error:
+        return str(error), 404
+
+    return {"newick": tree.write(), "missing": missing}
+
+
+@view.route("/react/tree", methods=["POST"])
+def get_reference_subtree():
+    """Prune a stored reference tree to the requested strains.
+
+    Expects JSON with `strains` (Strain IDs) and `section` and/or `genus`; a
+    section is looked up within the genus if both are given.
+    """
+    content = request.get_json()
+
+    if not content or not content.get("strains"):
+        return "No strains received", 404
+
+    try:
+        tree, missing = query.prune_reference_tree(
+            content["strains"],
+            genus=content.get("genus"),
+            section=content.get("section"),
+        )
+    except ValueError as error:
+        return str(error), 404
 
-    return msa.fasta()
+    return {"newick": tree.write(), "missing": missing}
 
 
 @view.route("/strains")
@@ -198,6 +309,14 @@ def get_strains(strain_ids=None):
     query = (
         session.query(Strain)
         .join(Species, Section, Subgenus, Genus)
+        .options(
+            contains_eager(Strain.species)
+            .contains_eager(Species.section)
+            .contains_eager(Section.subgenus)
+            .contains_eager(Subgenus.genus),
+            selectinload(Strain.strain_names),
+            selectinload(Strain.markers).joinedload(Marker.marker_type),
+        )
         .order_by(Strain.id, Genus.name, Species.epithet)
     )
 
@@ -209,7 +328,7 @@ def get_strains(strain_ids=None):
             {
                 "id": strain.id,
                 "mycobank": strain.species.mycobank,
-                "subgenus": strain.species.section.subgenus,
+                "subgenus": strain.species.subgenus,
                 "section": strain.species.section.name,
                 "genus": strain.species.genus,
                 "epithet": strain.species.epithet,
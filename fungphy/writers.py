@@ -0,0 +1,221 @@
+"""Stream alignments to files or HTTP responses.
+
+Each format has an iter_* generator yielding text chunks, and a write_*
+function that writes those chunks to an open handle. Rows of a MultiMSA are
+never concatenated: each chunk is a slice of a single partition's sequence,
+so writing a supermatrix only holds the original MSAs in memory.
+"""
+
+import gzip
+import re
+
+from fungphy.phylogeny import MSA, MultiMSA
+
+
+FORMATS = ("fasta", "phylip", "phylip-interleaved", "nexus", "nexus-interleaved")
+
+NEXUS_UNQUOTED = re.compile(r"^[A-Za-z0-9_.\-]+$")
+
+
+def partitions(msa):
+    """Return a MultiMSA's MSAs, or an MSA as a single partition."""
+    if isinstance(msa, MultiMSA):
+        return list(msa)
+    if isinstance(msa, MSA):
+        return [msa]
+    raise TypeError("Expected MSA or MultiMSA object")
+
+
+def iter_row_parts(msa):
+    """Yield (header, [sequence per partition]) for each row of an alignment.
+
+    Headers missing from a partition of a padded MultiMSA share one gap
+    string per partition.
+    """
+    msas = partitions(msa)
+    if len(msas) == 1:
+        for record in msas[0]:
+            yield str(record.header), [record.sequence]
+        return
+    records = [{r.header: r.sequence for r in m} for m in msas]
+    gaps = ["-" * len(m) for m in msas]
+    for header in msa.headers:
+        yield str(header), [
+            record.get(header, gap) for record, gap in zip(records, gaps)
+        ]
+
+
+def alignment_length(msa):
+    return sum(len(m) for m in partitions(msa))
+
+
+def alignment_size(msa):
+    return len(msa.headers)
+
+
+def iter_fasta(msa, width=None):
+    """Yield an alignment in FASTA format, optionally wrapped to width."""
+    for header, parts in iter_row_parts(msa):
+        yield f">{header}\n"
+        if not width:
+            yield from parts
+            yield "\n"
+            continue
+        for line in _iter_lines(parts, width):
+            yield from line
+            yield "\n"
+
+
+def _iter_lines(parts, width):
+    """Yield lists of chunks covering each line of width columns."""
+    line, used = [], 0
+    for part in parts:
+        start = 0
+        while start < len(part):
+            stop = start + width - used
+            chunk = part[start:stop]
+            line.append(chunk)
+            used += len(chunk)
+            start = stop
+            if used == width:
+                yield line
+                line, used = [], 0
+    if line:
+        yield line
+
+
+def _slice_parts(parts, start, stop):
+    """Yield chunks of row parts covering alignment columns start:stop."""
+    offset = 0
+    for part in parts:
+        end = offset + len(part)
+        if end > start and offset < stop:
+            yield part[max(start - offset, 0) : stop - offset]
+        if end >= stop:
+            break
+        offset = end
+
+
+def iter_phylip(msa, interleaved=False, block=60):
+    """Yield an alignment in relaxed PHYLIP format.
+
+    Headers are padded to a common width. Interleaved output writes block
+    columns of every row at a time, with headers on the first block only.
+    """
+    rows = list(iter_row_parts(msa))
+    length = alignment_length(msa)
+    yield f"{len(rows)} {length}\n"
+    if not rows:
+        return
+    width = max(len(header) for header, _ in rows) + 1
+    if not interleaved:
+        for header, parts in rows:
+            yield header.ljust(width)
+            yield from parts
+            yield "\n"
+        return
+    for start in range(0, length, block):
+        if start:
+            yield "\n"
+        for header, parts in rows:
+            yield header.ljust(width) if not start else " " * width
+            yield from _slice_parts(parts, start, start + block)
+            yield "\n"
+
+
+def nexus_name(name):
+    """Quote a taxon or character set name if NEXUS requires it."""
+    name = str(name)
+    if NEXUS_UNQUOTED.match(name):
+        return name
+    escaped = name.replace("'", "''")
+    return f"'{escaped}'"
+
+
+def iter_partition_ranges(msa):
+    """Yield (name, start, end) for each partition, 1-based inclusive."""
+    start = 1
+    for i, m in enumerate(partitions(msa), 1):
+        end = start + len(m) - 1
+        yield m.name or f"part{i}", start, end
+        start = end + 1
+
+
+def iter_nexus(msa, interleaved=False, block=60):
+    """Yield an alignment in NEXUS format.
+
+    A MultiMSA also gets a SETS block with one charset per partition and a
+    charpartition combining them.
+    """
+    rows = list(iter_row_parts(msa))
+    length = alignment_length(msa)
+    names = [nexus_name(header) for header, _ in rows]
+    width = max((len(name) for name in names), default=0) + 1
+
+    yield "#NEXUS\n\nBEGIN DATA;\n"
+    yield f"  DIMENSIONS NTAX={len(rows)} NCHAR={length};\n"
+    yield "  FORMAT DATATYPE=DNA MISSING=? GAP=-"
+    yield " INTERLEAVE;\n" if interleaved else ";\n"
+    yield "  MATRIX\n"
+    if interleaved:
+        for start in range(0, length, block):
+            if start:
+                yield "\n"
+            for name, (_, parts) in zip(names, rows):
+                yield f"  {name.ljust(width)}"
+                yield from _slice_parts(parts, start, start + block)
+                yield "\n"
+    else:
+        for name, (_, parts) in zip(names, rows):
+            yield f"  {name.ljust(width)}"
+            yield from parts
+            yield "\n"
+    yield "  ;\nEND;\n"
+
+    if isinstance(msa, MultiMSA):
+        ranges = list(iter_partition_ranges(msa))
+        yield "\nBEGIN SETS;\n"
+        for name, start, end in ranges:
+            yield f"  CHARSET {nexus_name(name)} = {start}-{end};\n"
+        combined = ", ".join(
+            f"{nexus_name(name)}:{start}-{end}" for name, start, end in ranges
+        )
+        yield f"  CHARPARTITION markers = {combined};\n"
+        yield "END;\n"
+
+
+def iter_raxml_partitions(msa):
+    """Yield partitions in RAxML format, one line per partition."""
+    for name, start, end in iter_partition_ranges(msa):
+        yield f"DNA, {name} = {start}-{end}\n"
+
+
+def iter_alignment(msa, format="fasta", **kwargs):
+    """Yield an alignment in one of FORMATS."""
+    if format == "fasta":
+        return iter_fasta(msa, **kwargs)
+    if format in ("phylip", "phylip-interleaved"):
+        return iter_phylip(msa, interleaved=format.endswith("interleaved"), **kwargs)
+    if format in ("nexus", "nexus-interleaved"):
+        return iter_nexus(msa, interleaved=format.endswith("interleaved"), **kwargs)
+    raise ValueError(f"Expected one of: {', '.join(FORMATS)}")
+
+
+def open_output(path, compress=None):
+    """Open a text file for writing, gzipped if compress or path ends in .gz."""
+    if compress is None:
+        compress = str(path).endswith(".gz")
+    if compress:
+        return gzip.open(path, "wt")
+    return open(path, "w")
+
+
+def write_alignment(fp, msa, format="fasta", **kwargs):
+    """Write an alignment to an open text handle, chunk by chunk."""
+    fp.writelines(iter_alignment(msa, format=format, **kwargs))
+
+
+def save_alignment(path, msa, format="fasta", compress=None, **kwargs):
+    """Write an alignment to a file path, gzipped if it ends in .gz."""
+    with open_output(path, compress=compress) as fp:
+        write_alignment(fp, msa, format=format, **kwargs)
@@ -27,7 +27,14 @@ setup(
         "Topic :: Scientific/Engineering :: Bio-Informatics",
         "License :: OSI Approved :: MIT License",
     ],
-    install_requires=["ete3", "flask", "flask-sqlalchemy", "flask-admin"],
+    install_requires=["ete3", "flask", "flask-sqlalchemy", "flask-admin", "numpy"],
     python_requires=">=3.6",
-    entry_points={"console_scripts": ["fungphy=fungphy.main:main"]},
+    entry_points={
+        "console_scripts": [
+            "fungphy=fungphy.main:main",
+            "fungphy-compare=fungphy.compare:main",
+            "fungphy-render=fungphy.render:main",
+            "fungphy-synth=fungphy.synthetic:main",
+        ]
+    },
 )